@@ -1,6 +1,109 @@
+from django.conf import settings
 from django.contrib import admin
-from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.admin import GroupAdmin, UserAdmin
+from django.contrib.auth.models import Group, Permission
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
 from .models import User
 
-admin.site.register(User, UserAdmin)
+
+def estimated_count(queryset):
+    """
+    return the planner row estimate of ``queryset``, None when the database
+    has no statistics for it
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+            estimate = row[0] if row else -1
+        else:
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            estimate = cursor.fetchone()[0][0]["Plan"]["Plan Rows"]
+    # never analyzed tables report -1
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    exact counts up to ``ADMIN_EXACT_COUNT_THRESHOLD`` rows, the postgres
+    estimate above it
+
+    The exact count is bounded with a LIMIT so it never scans more than the
+    threshold, large tables never run a full ``COUNT(*)``.
+    """
+
+    @cached_property
+    def count(self):
+        threshold = getattr(settings, "ADMIN_EXACT_COUNT_THRESHOLD", 10000)
+        bounded = self.object_list[: threshold + 1].count()
+        if bounded <= threshold:
+            return bounded
+        estimate = estimated_count(self.object_list)
+        if estimate is None:
+            return super(EstimatedCountPaginator, self).count
+        return max(estimate, bounded)
+
+
+@admin.register(User)
+class AccountsUserAdmin(UserAdmin):
+    """
+    user admin for large user tables
+    """
+
+    paginator = EstimatedCountPaginator
+    # the unfiltered total would be a second full count
+    show_full_result_count = False
+    # prefix matches, served by the indexes of migration 0002
+    search_fields = ("^username", "^email", "^first_name")
+    list_display = (
+        "username",
+        "email",
+        "first_name",
+        "last_name",
+        "is_staff",
+        "role_names",
+    )
+    autocomplete_fields = ("groups", "user_permissions")
+
+    def get_queryset(self, request):
+        queryset = super(AccountsUserAdmin, self).get_queryset(request)
+        return queryset.prefetch_related("groups")
+
+    @admin.display(description="Roles")
+    def role_names(self, obj):
+        return ", ".join(group.name for group in obj.groups.all())
+
+
+admin.site.unregister(Group)
+
+
+@admin.register(Group)
+class AccountsGroupAdmin(GroupAdmin):
+    """
+    role admin picking permissions with autocomplete
+    """
+
+    filter_horizontal = ()
+    autocomplete_fields = ("permissions",)
+
+
+@admin.register(Permission)
+class PermissionAdmin(admin.ModelAdmin):
+    """
+    permission admin, searched by the autocomplete widgets
+    """
+
+    list_display = ("name", "codename", "content_type")
+    list_select_related = ("content_type",)
+    search_fields = ("^codename", "name", "content_type__app_label")
+    paginator = EstimatedCountPaginator
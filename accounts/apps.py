@@ -4,3 +4,35 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "accounts"
+
+    def ready(self):
+        from . import checks, signals  # noqa
+        from .audit import audit_stats
+        from .caching import response_cache_hits
+        from .metrics import counter_collector, registry
+        from .throttling import throttle_hits
+
+        registry.add_collector(
+            counter_collector(
+                "accounts_response_cache_total",
+                "List response cache lookups by cache and outcome.",
+                response_cache_hits,
+                ["cache", "outcome"],
+            )
+        )
+        registry.add_collector(
+            counter_collector(
+                "accounts_throttle_total",
+                "Rate limit decisions by scope and outcome.",
+                throttle_hits,
+                ["scope", "outcome"],
+            )
+        )
+        registry.add_collector(
+            counter_collector(
+                "accounts_audit_events_total",
+                "Audit buffer events by outcome.",
+                audit_stats,
+                ["outcome"],
+            )
+        )
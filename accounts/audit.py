@@ -0,0 +1,124 @@
+import atexit
+import logging
+import os
+import threading
+from collections import Counter, deque
+
+from django.conf import settings
+from django.db import connection
+
+from .models import AuthAuditEvent
+
+logger = logging.getLogger(__name__)
+
+# "recorded" | "dropped" | "flushed" | "failed" -> count, per process
+audit_stats = Counter()
+
+
+def client_ip(request):
+    if request is None:
+        return None
+    return request.META.get("REMOTE_ADDR") or None
+
+
+class AuditBuffer(object):
+    """
+    bounded in-process buffer of audit events written with ``bulk_create``
+
+    A background thread flushes the buffer once it holds ``flush_size`` events
+    or every ``flush_interval`` seconds. A full buffer drops new events and
+    counts them, recording never blocks or touches the database.
+    """
+
+    def __init__(self, capacity, flush_size, flush_interval, threaded=True):
+        self.capacity = capacity
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.threaded = threaded
+        self.events = deque()
+        self.condition = threading.Condition()
+        self.pid = None
+
+    def record(self, event, username="", actor=None, ip_address=None, **detail):
+        entry = AuthAuditEvent(
+            event=event,
+            username=username or "",
+            actor_id=getattr(actor, "pk", None),
+            ip_address=ip_address,
+            detail=detail,
+        )
+        with self.condition:
+            if len(self.events) >= self.capacity:
+                audit_stats["dropped"] += 1
+                return False
+            self.events.append(entry)
+            audit_stats["recorded"] += 1
+            if len(self.events) >= self.flush_size:
+                self.condition.notify()
+        if self.threaded:
+            self.ensure_started()
+        return True
+
+    def take(self):
+        with self.condition:
+            count = min(len(self.events), self.flush_size)
+            return [self.events.popleft() for _ in range(count)]
+
+    def flush(self):
+        """
+        write every buffered event, return the number written
+        """
+        written = 0
+        while True:
+            events = self.take()
+            if not events:
+                return written
+            try:
+                AuthAuditEvent.objects.bulk_create(events)
+            except Exception:
+                audit_stats["failed"] += len(events)
+                logger.exception("dropped %s audit events", len(events))
+                continue
+            audit_stats["flushed"] += len(events)
+            written += len(events)
+
+    def ensure_started(self):
+        # a forked worker inherits the buffer but not the thread
+        if self.pid == os.getpid():
+            return
+        with self.condition:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            thread = threading.Thread(
+                target=self.run, name="accounts-audit", daemon=True
+            )
+            thread.start()
+
+    def run(self):
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(
+                        lambda: len(self.events) >= self.flush_size,
+                        timeout=self.flush_interval,
+                    )
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception("audit flush failed")
+                finally:
+                    connection.close()
+        finally:
+            # the next record starts a new thread
+            with self.condition:
+                self.pid = None
+
+
+audit_log = AuditBuffer(
+    capacity=getattr(settings, "AUDIT_BUFFER_CAPACITY", 10000),
+    flush_size=getattr(settings, "AUDIT_FLUSH_SIZE", 500),
+    flush_interval=getattr(settings, "AUDIT_FLUSH_INTERVAL", 2.0),
+    threaded=getattr(settings, "AUDIT_FLUSH_THREAD", True),
+)
+atexit.register(audit_log.flush)
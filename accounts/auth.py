@@ -1,6 +1,7 @@
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
 from accounts.auth_state import backend_cls
+from accounts.timing import timed
 
 
 class CustomJWTAuthentication(JWTAuthentication):
@@ -13,6 +14,7 @@ class CustomJWTAuthentication(JWTAuthentication):
         if raw_token is None:
             return None
 
-        backend = backend_cls()
-        validated_token = backend.validate_token(request, raw_token)
-        return self.get_user(validated_token), validated_token
+        with timed("auth"):
+            backend = backend_cls()
+            validated_token = backend.validate_token(request, raw_token)
+            return self.get_user(validated_token), validated_token
@@ -1,18 +1,48 @@
+import hashlib
+import json
+
 import requests
+from django.core.cache import cache
+from django.utils import timezone
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
 
 from core.exceptions import AppException
 
 from .models import User
+from .metrics import remote_call, token_validations
+from .timing import timed
+from .versions import bump_data_generation, bump_user_version, user_version
 
 GET = "GET"
 POST = "POST"
-
-
-def request(method, url, **kwargs):
-    response = requests.request(method, url, **kwargs)
+PROFILE_HASH_KEY = "accounts:profile_hash:{}"
+
+
+class AuthServerError(AppException):
+    """
+    error answer of the auth server, keeps its status and body
+    """
+
+    def __init__(self, remote_status, remote_detail=""):
+        super(AuthServerError, self).__init__("Authorization Server Error")
+        self.remote_status = remote_status
+        self.remote_detail = remote_detail
+
+
+def request(method, url, backend="", endpoint="", not_found=None, **kwargs):
+    """
+    return the JSON response, ``not_found`` instead of an error on 404 when
+    it is given
+    """
+    with timed("remote"), remote_call(backend, endpoint) as call:
+        response = requests.request(method, url, **kwargs)
+        call["status"] = response.status_code
+    if response.status_code == 404 and not_found is not None:
+        return not_found
     if response.status_code > 399:
-        raise AppException("Authorization Server Error")
+        raise AuthServerError(response.status_code, response.text)
     return response.json()
 
 
@@ -27,6 +57,7 @@ class AuthBackendBase(JWTAuthentication):
     SCOPE_SEPARATOR = ","
     user_fields = ["first_name", "last_name", "email", "is_active"]
     API_MAP = {"create_user": "users"}
+    PROFILE_HASH_TIMEOUT = 60 * 60 * 24
 
     def __str__(self):
         return self.name
@@ -54,38 +85,64 @@ class AuthBackendBase(JWTAuthentication):
     def user_api_path(cls):
         return f"{cls.USER_PROFILE}"
 
+    @classmethod
+    def call(cls, method, path, **kwargs):
+        """
+        request ``path`` of the auth server api
+        """
+        url = cls.construct_api(path)
+        return request(method, url, backend=cls.__name__, endpoint=path, **kwargs)
+
     @classmethod
     def auth_header(cls, access_token):
         return {"Authorization": f"{cls.AUTH_HEADER_TYPE} {access_token}"}
 
     def validate_token(self, request, raw_token):
-        validated_token = self.get_validated_token(raw_token)
+        with timed("token"):
+            try:
+                validated_token = self.get_validated_token(raw_token)
+            except InvalidToken:
+                token_validations.inc(result="invalid")
+                raise
+        token_validations.inc(result="valid")
         access_token = raw_token.decode("utf-8")
-        self.authorize(request, access_token)
+        self.authorize(request, access_token, validated_token)
         context = {"access_token": access_token}
         setattr(request, "context", context)
         return validated_token
 
     @classmethod
     def user_detail(cls, access_token, method=GET, *args, **kwargs):
-        user_info = request(
-            method,
-            cls.construct_api(cls.user_api_path()),
-            headers=cls.auth_header(access_token),
+        user_info = cls.call(
+            method, cls.user_api_path(), headers=cls.auth_header(access_token)
         )
         return user_info
 
     @classmethod
-    def create_remote_user(cls, access_token, method, data):
-        user_info = request(
-            method,
-            cls.construct_api(cls.API_MAP["create_user"]),
-            data=data,
-            headers=cls.auth_header(access_token),
+    def create_remote_user(cls, access_token, method, data, idempotency_key=None):
+        headers = cls.auth_header(access_token)
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
+        user_info = cls.call(
+            method, cls.API_MAP["create_user"], data=data, headers=headers
         )
         return user_info
 
-    def authorize(self, request, access_token):
+    @classmethod
+    def list_remote_users(cls, access_token, page=1, page_size=None):
+        params = {"page": page}
+        if page_size:
+            params["page_size"] = page_size
+        # servers paginating plain lists answer 404 past the last page
+        return cls.call(
+            GET,
+            cls.API_MAP["create_user"],
+            params=params,
+            headers=cls.auth_header(access_token),
+            not_found=[],
+        )
+
+    def authorize(self, request, access_token, validated_token=None):
         """Authorization logic
 
         * Update user data
@@ -93,9 +150,65 @@ class AuthBackendBase(JWTAuthentication):
 
         """
         user_info = self.user_detail(access_token)
-        # TODO : update user data
+        username = user_info.get("username")
+        if validated_token is not None:
+            username = validated_token.get(api_settings.USER_ID_CLAIM, username)
+        if username:
+            self.sync_user(username, user_info)
         return user_info
 
+    @classmethod
+    def profile_hash(cls, user_info):
+        profile = {
+            field: user_info[field] for field in cls.user_fields if field in user_info
+        }
+        return hashlib.sha1(json.dumps(profile, sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def sync_user(cls, username, user_info):
+        """Apply remote profile changes to the local user
+
+        The hash of the applied profile is stored on the user row, nothing is
+        read while it matches the cached hash of an unchanged row version.
+        Local edits bump the version, the remote profile then wins again.
+        Changes are applied only while the row still holds the hash they
+        were compared against, of concurrent logins the first one wins.
+
+        """
+        profile_hash = cls.profile_hash(user_info)
+        hash_key = PROFILE_HASH_KEY.format(username)
+        cached = cache.get(hash_key)
+        if cached is not None:
+            cached_hash, pk, version = cached
+            if cached_hash == profile_hash and user_version(pk) == version:
+                return False
+        fields = [field for field in cls.user_fields if field in user_info]
+        user = (
+            User.objects.filter(username=username)
+            .only("profile_hash", *fields)
+            .first()
+        )
+        if user is None:
+            return False
+        changes = {
+            field: user_info[field]
+            for field in fields
+            if getattr(user, field) != user_info[field]
+        }
+        if changes or user.profile_hash != profile_hash:
+            applied = User.objects.filter(
+                pk=user.pk, profile_hash=user.profile_hash
+            ).update(profile_hash=profile_hash, last_updated=timezone.now(), **changes)
+            if not applied:
+                # a concurrent login applied its profile first
+                return False
+            if changes:
+                bump_user_version(user.pk)
+                bump_data_generation()
+        version = user_version(user.pk)
+        cache.set(hash_key, (profile_hash, user.pk, version), cls.PROFILE_HASH_TIMEOUT)
+        return bool(changes)
+
     @classmethod
     def create_new_user(cls, access_token, password, username):
         # TODO : later move to storage package
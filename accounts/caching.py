@@ -0,0 +1,44 @@
+import hashlib
+from collections import Counter
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .versions import data_generation
+
+# ("cache name", "hit" | "miss") -> count, per process
+response_cache_hits = Counter()
+
+
+def response_cache():
+    return caches[getattr(settings, "RESPONSE_CACHE_ALIAS", "default")]
+
+
+def normalized_query(request):
+    """
+    query string with sorted keys and values, equal queries share an entry
+    """
+    items = sorted(
+        (key, value) for key, values in request.GET.lists() for value in values
+    )
+    return urlencode(items)
+
+
+def response_cache_key(name, request):
+    """
+    key of a cached response, a data generation bump orphans every key
+    """
+    query = f"{request.get_host()}?{normalized_query(request)}"
+    digest = hashlib.md5(query.encode()).hexdigest()
+    return f"accounts:response:{name}:{data_generation()}:{digest}"
+
+
+def response_cache_stats():
+    stats = {}
+    for (name, outcome), count in response_cache_hits.items():
+        stats.setdefault(name, {"hit": 0, "miss": 0})[outcome] = count
+    for counts in stats.values():
+        total = counts["hit"] + counts["miss"]
+        counts["hit_ratio"] = counts["hit"] / total if total else 0
+    return stats
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@register(Tags.caches)
+def shared_cache_check(app_configs, **kwargs):
+    """
+    the default cache holds the user versions, the permission and data
+    generations and the idempotency keys, every worker has to see the same
+    values
+    """
+    if settings.DEBUG:
+        return []
+    backend = settings.CACHES.get("default", {}).get("BACKEND", "")
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [
+        Error(
+            f"The default cache {backend} is not shared between processes.",
+            hint=(
+                "Set CACHE_BACKEND and CACHE_LOCATION to a shared cache such "
+                "as redis or memcached. Silence accounts.E001 only when a "
+                "single process serves the app."
+            ),
+            id="accounts.E001",
+        )
+    ]
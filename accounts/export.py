@@ -0,0 +1,75 @@
+import csv
+import json
+from collections import defaultdict
+from itertools import islice
+
+from .models import User
+
+EXPORT_FIELDS = ["id", "username", "email", "first_name", "last_name", "is_active"]
+ROLE_SEPARATOR = ";"
+
+
+class Echo(object):
+    """
+    file like object for csv.writer, returns the row instead of buffering it
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_user_chunks(queryset, chunk_size=2000):
+    """
+    yield lists of ``(row, role names)`` read through a server-side cursor
+
+    Role names are fetched with one query per chunk, so memory only holds a
+    single chunk whatever the table size.
+    """
+    rows = (
+        queryset.order_by("pk")
+        .values_list(*EXPORT_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        roles = defaultdict(list)
+        memberships = User.groups.through.objects.filter(
+            user_id__in=[row[0] for row in chunk]
+        ).values_list("user_id", "group__name")
+        for user_id, name in memberships:
+            roles[user_id].append(name)
+        yield [(row, roles.get(row[0], [])) for row in chunk]
+
+
+def ndjson_stream(queryset, chunk_size=2000):
+    """
+    yield one newline delimited JSON block per chunk
+    """
+    for chunk in iter_user_chunks(queryset, chunk_size):
+        lines = []
+        for row, roles in chunk:
+            data = dict(zip(EXPORT_FIELDS, row))
+            data["roles"] = roles
+            lines.append(json.dumps(data))
+        yield "\n".join(lines) + "\n"
+
+
+def csv_stream(queryset, chunk_size=2000):
+    """
+    yield the csv header followed by one csv block per chunk
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS + ["roles"])
+    for chunk in iter_user_chunks(queryset, chunk_size):
+        yield "".join(
+            writer.writerow(list(row) + [ROLE_SEPARATOR.join(roles)])
+            for row, roles in chunk
+        )
+
+
+EXPORT_FORMATS = {
+    "ndjson": (ndjson_stream, "application/x-ndjson", "users.ndjson"),
+    "csv": (csv_stream, "text/csv", "users.csv"),
+}
@@ -0,0 +1,57 @@
+import django_filters
+from django.db.models import Q
+
+from .models import AuthAuditEvent, User
+
+
+class UserFilter(django_filters.FilterSet):
+    """
+    users listing filters
+
+    Text filters are case insensitive prefix matches and ``search`` is a
+    substring match, both are backed by the search indexes of migration 0002.
+    """
+
+    search = django_filters.CharFilter(method="filter_search")
+    username = django_filters.CharFilter(lookup_expr="istartswith")
+    email = django_filters.CharFilter(lookup_expr="istartswith")
+    first_name = django_filters.CharFilter(lookup_expr="istartswith")
+    is_active = django_filters.BooleanFilter()
+    role = django_filters.NumberFilter(field_name="groups")
+    role_name = django_filters.CharFilter(field_name="groups__name")
+
+    class Meta:
+        model = User
+        fields = [
+            "search",
+            "username",
+            "email",
+            "first_name",
+            "is_active",
+            "role",
+            "role_name",
+        ]
+
+    def filter_search(self, queryset, name, value):
+        return queryset.filter(
+            Q(username__icontains=value)
+            | Q(email__icontains=value)
+            | Q(first_name__icontains=value)
+        )
+
+
+class AuthAuditEventFilter(django_filters.FilterSet):
+    """
+    audit log filters, every filter is served by a ``(…, occurred_at)`` index
+    """
+
+    since = django_filters.IsoDateTimeFilter(
+        field_name="occurred_at", lookup_expr="gte"
+    )
+    until = django_filters.IsoDateTimeFilter(field_name="occurred_at", lookup_expr="lt")
+    event = django_filters.ChoiceFilter(choices=AuthAuditEvent.EVENT_CHOICES)
+    username = django_filters.CharFilter()
+
+    class Meta:
+        model = AuthAuditEvent
+        fields = ["since", "until", "event", "username"]
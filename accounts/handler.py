@@ -1,11 +1,19 @@
+import threading
+import time
+
 import requests
 from django.conf import settings
 from rest_framework_simplejwt.tokens import AccessToken
 
+from accounts.audit import audit_log
 from accounts.backends import AuthBackendBase
-from accounts.models import User
+from accounts.metrics import remote_call
+from accounts.models import AuthAuditEvent, User
 from core.exceptions import AppException
 
+# service tokens are renewed this many seconds before they expire
+SERVICE_TOKEN_MARGIN = 60
+
 
 class BaseAuthHandler(object):
     name = "base_auth_handler"
@@ -17,6 +25,8 @@ class BaseAuthHandler(object):
 
     def __init__(self, backend: AuthBackendBase):
         self.backend = backend
+        self.service_token = (None, 0)
+        self.service_lock = threading.Lock()
 
     def __str__(self):
         return self.name
@@ -46,10 +56,13 @@ class BaseAuthHandler(object):
     def refresh_url(self):
         return self.backend.refresh_token_url()
 
-    def login(self, username, password, method="POST"):
-        response = requests.request(
-            method, self.login_url(), data=self.login_payload(username, password),
-        )
+    def login(self, username, password, method="POST", ip_address=None):
+        backend = self.backend
+        with remote_call(backend.__name__, backend.ACCESS_TOKEN_PATH) as call:
+            response = requests.request(
+                method, self.login_url(), data=self.login_payload(username, password),
+            )
+            call["status"] = response.status_code
         auth_response = response.json()
         if response.status_code == 200:
             access_token = AccessToken(auth_response["access"])
@@ -57,26 +70,64 @@ class BaseAuthHandler(object):
                 self.backend.create_new_user(
                     auth_response["access"], password, username
                 )
+            audit_log.record(AuthAuditEvent.LOGIN, username, ip_address=ip_address)
         else:
+            audit_log.record(
+                AuthAuditEvent.LOGIN_FAILED,
+                username,
+                ip_address=ip_address,
+                status=response.status_code,
+            )
             raise AppException(auth_response["detail"])
         return auth_response
 
-    def refresh(self, refresh, method="POST"):
-        response = requests.request(
-            method,
-            self.refresh_url(),
-            data=self.refresh_payload(refresh_token=refresh),
-        )
+    def refresh(self, refresh, method="POST", ip_address=None):
+        backend = self.backend
+        with remote_call(backend.__name__, backend.REFRESH_TOKEN_PATH) as call:
+            response = requests.request(
+                method,
+                self.refresh_url(),
+                data=self.refresh_payload(refresh_token=refresh),
+            )
+            call["status"] = response.status_code
         auth_response = response.json()
         if response.status_code == 200:
+            audit_log.record(AuthAuditEvent.REFRESH, ip_address=ip_address)
             return auth_response
         else:
+            audit_log.record(
+                AuthAuditEvent.REFRESH_FAILED,
+                ip_address=ip_address,
+                status=response.status_code,
+            )
             raise AppException(auth_response["detail"])
 
     def access_token(self, request):
         context = getattr(request, "context", {})
         return context.get("access_token")
 
+    def service_access_token(self):
+        """
+        access token of ``AUTH_SERVICE_USERNAME``, None when it is not set
+        """
+        username = getattr(settings, "AUTH_SERVICE_USERNAME", "")
+        if not username:
+            return None
+        with self.service_lock:
+            token, expires = self.service_token
+            if token is None or expires - time.time() < SERVICE_TOKEN_MARGIN:
+                backend = self.backend
+                payload = self.login_payload(username, settings.AUTH_SERVICE_PASSWORD)
+                with remote_call(backend.__name__, backend.ACCESS_TOKEN_PATH) as call:
+                    response = requests.request("POST", self.login_url(), data=payload)
+                    call["status"] = response.status_code
+                auth_response = response.json()
+                if response.status_code != 200:
+                    raise AppException(auth_response["detail"])
+                token = auth_response["access"]
+                self.service_token = (token, AccessToken(token)["exp"])
+            return token
+
     def create_remote_user(self, request, data=None, method="POST"):
         if data is None:
             data = {}
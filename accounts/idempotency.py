@@ -0,0 +1,117 @@
+import functools
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.exceptions import AppException
+
+from .outbox import outbox_payload
+
+HEADER = "HTTP_IDEMPOTENCY_KEY"
+RESULT_KEY = "accounts:idempotency:{}"
+LOCK_KEY = "accounts:idempotency_lock:{}"
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05
+# replayed headers, the rest is recomputed by the middleware
+STORED_HEADERS = ("Location", "ETag")
+
+
+def request_fingerprint(request):
+    body = json.dumps(outbox_payload(request.data), sort_keys=True, default=str)
+    return hashlib.md5(f"{request.method} {request.path}\n{body}".encode()).hexdigest()
+
+
+def replay(stored, fingerprint):
+    if stored["fingerprint"] != fingerprint:
+        return Response(
+            {"detail": "Idempotency-Key was used with a different request."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    response = Response(
+        stored["data"], status=stored["status"], headers=stored["headers"]
+    )
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def run_idempotent(request, name, handler):
+    """
+    run ``handler`` once per ``Idempotency-Key`` of the user, or of the
+    request body for anonymous callers
+
+    The first response is stored for ``IDEMPOTENCY_TTL`` seconds and replayed
+    on retries. A retry arriving while the original is still running waits up
+    to ``IDEMPOTENCY_WAIT`` seconds for its response. Errors raised by the
+    handler and 5xx responses are not stored so the request can be retried.
+    Responses and locks live in the default cache, a retry reaching another
+    worker only finds them in a shared cache, see the accounts.E001 check.
+    """
+    key = request.META.get(HEADER)
+    if not key:
+        return handler()
+    if len(key) > MAX_KEY_LENGTH:
+        raise AppException(
+            f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters."
+        )
+    fingerprint = request_fingerprint(request)
+    # anonymous callers share no user, only a client sending the very same
+    # request can replay its response
+    owner = request.user.pk if request.user.is_authenticated else fingerprint
+    scope = hashlib.md5(f"{name}:{owner}:{key}".encode()).hexdigest()
+    result_key, lock_key = RESULT_KEY.format(scope), LOCK_KEY.format(scope)
+    lock_timeout = getattr(settings, "IDEMPOTENCY_LOCK_TIMEOUT", 60)
+    deadline = time.monotonic() + getattr(settings, "IDEMPOTENCY_WAIT", 10)
+    while True:
+        stored = cache.get(result_key)
+        if stored is not None:
+            return replay(stored, fingerprint)
+        if cache.add(lock_key, fingerprint, lock_timeout):
+            break
+        if time.monotonic() >= deadline:
+            return Response(
+                {"detail": "A request with this Idempotency-Key is in progress."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        time.sleep(POLL_INTERVAL)
+    try:
+        # the original may have finished between the lookup and the lock
+        stored = cache.get(result_key)
+        if stored is not None:
+            return replay(stored, fingerprint)
+        response = handler()
+        if response.status_code < 500:
+            stored = {
+                "fingerprint": fingerprint,
+                "status": response.status_code,
+                "data": response.data,
+                "headers": {
+                    header: response[header]
+                    for header in STORED_HEADERS
+                    if response.has_header(header)
+                },
+            }
+            cache.set(result_key, stored, getattr(settings, "IDEMPOTENCY_TTL", 86400))
+    finally:
+        cache.delete(lock_key)
+    return response
+
+
+def idempotent(handler):
+    """
+    make a view handler honour the ``Idempotency-Key`` header
+    """
+
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        return run_idempotent(
+            request,
+            type(self).__name__,
+            lambda: handler(self, request, *args, **kwargs),
+        )
+
+    return wrapper
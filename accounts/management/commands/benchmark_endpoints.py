@@ -0,0 +1,265 @@
+import json
+import math
+import time
+from datetime import datetime, timezone
+from unittest import mock
+
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLResolver, reverse
+from rest_framework.throttling import SimpleRateThrottle
+
+from accounts import urls
+from accounts.audit import audit_log
+from accounts.management.seed import rollback, seed_accounts
+from accounts.management.stub_auth import StubAuthServer
+from accounts.models import RemoteUserOutbox, User
+from accounts.permissions import GENERATION_KEY
+from accounts.versions import (
+    DATA_GENERATION_KEY,
+    ROLES_VERSION_KEY,
+    bump_counter,
+    bump_counters,
+)
+
+PASSWORD = "bench-password"  # NOSONAR
+
+
+def url_names(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from url_names(pattern.url_patterns)
+        elif pattern.name:
+            yield pattern.name
+
+
+def percentile(values, percent):
+    """
+    nearest rank percentile of sorted ``values``
+    """
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
+
+
+class Command(BaseCommand):
+    help = "Measure latency and queries of the accounts endpoints"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--roles", type=int, default=20)
+        parser.add_argument("--requests", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument(
+            "--latency", type=float, default=0.0, help="auth server delay in seconds"
+        )
+        parser.add_argument(
+            "--failure-rate",
+            type=float,
+            default=0.0,
+            help="share of auth server requests answering 503",
+        )
+        parser.add_argument(
+            "--cold",
+            action="store_true",
+            help="invalidate the list response cache before every request",
+        )
+        parser.add_argument("--only", nargs="*", help="url names to measure")
+        parser.add_argument("--label", default="", help="stored with the results")
+        parser.add_argument("--output", help="JSON results path")
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1:
+            raise CommandError("--requests must be at least 1")
+        started_at = datetime.now(timezone.utc)
+        output = options["output"] or "benchmark-endpoints-{}.json".format(
+            started_at.strftime("%Y%m%dT%H%M%S")
+        )
+        stub = StubAuthServer(options["latency"], options["failure_rate"], seed=0)
+        rates = {scope: None for scope in SimpleRateThrottle.THROTTLE_RATES}
+        # batch worker threads would not see the uncommitted seed data, audit
+        # events are written on another connection the rollback does not undo
+        no_audit = mock.patch.object(audit_log, "record", return_value=True)
+        no_throttle = mock.patch.object(SimpleRateThrottle, "THROTTLE_RATES", rates)
+        try:
+            with rollback(), stub, override_settings(BATCH_MAX_WORKERS=1):
+                with no_throttle, no_audit:
+                    seed_accounts(options["users"], options["roles"])
+                    results = self.run(stub, options)
+        finally:
+            # responses and permissions cached from the rolled back rows
+            bump_counters(DATA_GENERATION_KEY, ROLES_VERSION_KEY, GENERATION_KEY)
+        report = {
+            "label": options["label"],
+            "started_at": started_at.isoformat(),
+            "options": {
+                key: options[key]
+                for key in (
+                    "users",
+                    "roles",
+                    "requests",
+                    "warmup",
+                    "latency",
+                    "failure_rate",
+                    "cold",
+                )
+            },
+            "auth_server_calls": dict(stub.calls),
+            "endpoints": results,
+        }
+        with open(output, "w") as fp:
+            json.dump(report, fp, indent=2)
+        self.stdout.write(f"results written to {output}")
+
+    def login(self, client, stub):
+        user = User.objects.create(username="bench-admin", is_superuser=True)
+        stub.add_user(user.username, PASSWORD, first_name="bench")
+        response = client.post(
+            reverse("accounts:login_api"),
+            {"username": user.username, "password": PASSWORD},
+        )
+        if response.status_code != 200:
+            raise CommandError(f"stub login failed: {response.content!r}")
+        return user, response.json()
+
+    def endpoints(self, user, tokens):
+        role = Group.objects.order_by("pk").first()
+        member = User.objects.exclude(pk=user.pk).order_by("pk").first()
+        RemoteUserOutbox.objects.get_or_create(user=member)
+        return [
+            (
+                "login_api",
+                "post",
+                reverse("accounts:login_api"),
+                {"username": user.username, "password": PASSWORD},
+            ),
+            (
+                "token_refresh",
+                "post",
+                reverse("accounts:token_refresh"),
+                {"refresh": tokens["refresh"]},
+            ),
+            ("user_profile", "get", reverse("accounts:user_profile"), None),
+            ("create_list_user", "get", reverse("accounts:create_list_user"), None),
+            ("export_users", "get", reverse("accounts:export_users"), None),
+            (
+                "update_user",
+                "get",
+                reverse("accounts:update_user", kwargs={"pk": member.pk}),
+                None,
+            ),
+            (
+                "remote_user_status",
+                "get",
+                reverse("accounts:remote_user_status", kwargs={"pk": member.pk}),
+                None,
+            ),
+            (
+                "users_exists",
+                "post",
+                reverse("accounts:users_exists"),
+                {"username": member.username},
+            ),
+            ("rate_limits", "get", reverse("accounts:rate_limits"), None),
+            ("response_cache", "get", reverse("accounts:response_cache"), None),
+            ("audit_events", "get", reverse("accounts:audit_events"), None),
+            ("audit_stats", "get", reverse("accounts:audit_stats"), None),
+            (
+                "batch",
+                "post",
+                reverse("accounts:batch"),
+                {
+                    "requests": [
+                        {"path": reverse("accounts:user_profile")},
+                        {"path": reverse("accounts:group-list")},
+                        {"path": reverse("accounts:permissions")},
+                    ]
+                },
+            ),
+            ("permissions", "get", reverse("accounts:permissions"), None),
+            ("api-root", "get", reverse("accounts:api-root"), None),
+            ("group-list", "get", reverse("accounts:group-list"), None),
+            (
+                "group-detail",
+                "get",
+                reverse("accounts:group-detail", kwargs={"pk": role.pk}),
+                None,
+            ),
+            (
+                "group-bulk-assign",
+                "post",
+                reverse("accounts:group-bulk-assign"),
+                {"roles": [role.pk], "add_users": [member.pk]},
+            ),
+        ]
+
+    def run(self, stub, options):
+        # the seed data is only visible on the primary connection
+        client = Client(HTTP_X_READ_PRIMARY="1")
+        user, tokens = self.login(client, stub)
+        headers = {"HTTP_AUTHORIZATION": f"JWT {tokens['access']}"}
+        endpoints = self.endpoints(user, tokens)
+        missing = set(url_names(urls.urlpatterns)) - {item[0] for item in endpoints}
+        if missing:
+            self.stderr.write(f"not measured: {', '.join(sorted(missing))}")
+        results = {}
+        for name, method, path, data in endpoints:
+            if options["only"] and name not in options["only"]:
+                continue
+
+            def call():
+                if data is None:
+                    response = getattr(client, method)(path, **headers)
+                else:
+                    response = getattr(client, method)(
+                        path,
+                        json.dumps(data),
+                        content_type="application/json",
+                        **headers,
+                    )
+                if response.streaming:
+                    b"".join(response.streaming_content)
+                return response
+
+            results[name] = self.measure(call, options)
+            self.report(name, results[name])
+        return results
+
+    def measure(self, call, options):
+        for _ in range(options["warmup"]):
+            call()
+        latencies, queries, statuses = [], [], {}
+        for _ in range(options["requests"]):
+            if options["cold"]:
+                # right away, the benchmark transaction never commits
+                bump_counter(DATA_GENERATION_KEY)
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = call()
+                latencies.append(time.perf_counter() - started)
+            queries.append(len(captured))
+            code = str(response.status_code)
+            statuses[code] = statuses.get(code, 0) + 1
+        latencies.sort()
+        queries.sort()
+        return {
+            "requests": len(latencies),
+            "statuses": statuses,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "mean_ms": sum(latencies) / len(latencies) * 1000,
+            "throughput_rps": len(latencies) / sum(latencies),
+            "queries_p50": percentile(queries, 50),
+            "queries_max": queries[-1],
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name:<20} p50 {result['p50_ms']:8.2f} ms  "
+            f"p95 {result['p95_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+            f"{result['throughput_rps']:8.1f} req/s  "
+            f"queries {result['queries_p50']:>3}"
+        )
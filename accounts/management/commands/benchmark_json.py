@@ -0,0 +1,70 @@
+import io
+import time
+
+from django.contrib.auth.models import Group, Permission
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from accounts.management.seed import rollback, seed_accounts
+from accounts.models import User
+from accounts.parsers import FastJSONParser
+from accounts.readers import GroupReader, PermissionReader, UserReader
+from accounts.renderers import FastJSONRenderer, orjson
+
+SHAPES = [
+    ("users", User, UserReader),
+    ("roles", Group, GroupReader),
+    ("permissions", Permission, PermissionReader),
+]
+
+
+class Command(BaseCommand):
+    help = "Compare encode and decode throughput of the JSON renderers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--roles", type=int, default=20)
+        parser.add_argument("--page-size", type=int, default=100)
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def throughput(self, func, size, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        elapsed = time.perf_counter() - started
+        return size * repeat / elapsed / 1024 / 1024
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stderr.write("orjson is not installed, FastJSON* use the stdlib")
+        with rollback():
+            seed_accounts(options["users"], options["roles"])
+            payloads = []
+            for name, model, reader_class in SHAPES:
+                reader = reader_class()
+                rows = model.objects.values_list(*reader.lookups)
+                rows = list(rows[: options["page_size"]])
+                payloads.append((name, reader.read(rows)))
+        for name, data in payloads:
+            self.run(name, data, options["repeat"])
+
+    def run(self, name, data, repeat):
+        body = JSONRenderer().render(data)
+        size = len(body)
+        results = []
+        for renderer, parser in (
+            (JSONRenderer(), JSONParser()),
+            (FastJSONRenderer(), FastJSONParser()),
+        ):
+            encode = self.throughput(lambda: renderer.render(data), size, repeat)
+            decode = self.throughput(
+                lambda: parser.parse(io.BytesIO(body)), size, repeat
+            )
+            results.append((encode, decode))
+        (std_encode, std_decode), (fast_encode, fast_decode) = results
+        self.stdout.write(
+            f"{name:<12} {size:>8} bytes  "
+            f"encode {std_encode:8.1f} -> {fast_encode:8.1f} MB/s  "
+            f"decode {std_decode:8.1f} -> {fast_decode:8.1f} MB/s"
+        )
@@ -0,0 +1,69 @@
+import time
+
+from django.contrib.auth.models import Group, Permission
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from accounts.management.seed import rollback, seed_accounts
+from accounts.models import User
+from accounts.readers import GroupReader, PermissionReader, UserReader
+from accounts.serializers import (
+    GroupsGetDetailSerializer,
+    PermissionSerializer,
+    UsersListSerializer,
+)
+
+CASES = [
+    ("users", User, UsersListSerializer, UserReader),
+    ("roles", Group, GroupsGetDetailSerializer, GroupReader),
+    ("permissions", Permission, PermissionSerializer, PermissionReader),
+]
+
+
+class Command(BaseCommand):
+    help = "Compare list serializers with the values() fast readers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--roles", type=int, default=20)
+        parser.add_argument("--page-size", type=int, default=100)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def measure(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def handle(self, *args, **options):
+        with rollback():
+            seed_accounts(options["users"], options["roles"])
+            self.run(options["page_size"], options["repeat"])
+
+    def run(self, page_size, repeat):
+        renderer = JSONRenderer()
+        for name, model, serializer_class, reader_class in CASES:
+            queryset = model.objects.all()
+            lookups = serializer_class.get_prefetch_lookups()
+            reader = reader_class()
+
+            def serialize():
+                rows = queryset.prefetch_related(*lookups)[:page_size]
+                return renderer.render(serializer_class(rows, many=True).data)
+
+            def read():
+                rows = list(queryset.values_list(*reader.lookups)[:page_size])
+                return renderer.render(reader.read(rows))
+
+            serializer_time, expected = self.measure(serialize, repeat)
+            reader_time, actual = self.measure(read, repeat)
+            if expected != actual:
+                raise CommandError(f"{name}: fast reader output differs")
+            self.stdout.write(
+                f"{name:<12} serializer {serializer_time * 1000:8.2f} ms  "
+                f"reader {reader_time * 1000:8.2f} ms  "
+                f"x{serializer_time / reader_time:5.1f}  ({len(actual)} bytes)"
+            )
@@ -0,0 +1,38 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.openapi import (
+    SCHEMA_FORMATS,
+    encode_schema,
+    generate_schema,
+    schema_path,
+    schemas,
+)
+
+
+class Command(BaseCommand):
+    help = "Write the OpenAPI schema served at api/swagger.json and .yaml"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output-dir", help="defaults to the OPENAPI_SCHEMA_DIR setting"
+        )
+        parser.add_argument(
+            "--url", help="API url of the schema, the request host when omitted"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            schema = generate_schema(options["url"])
+        except ImportError as exc:
+            raise CommandError(f"drf_yasg is needed to build the schema: {exc}")
+        for extension in SCHEMA_FORMATS:
+            content = encode_schema(schema, extension)
+            path = schema_path(extension, options["output_dir"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f"{path}.tmp", "wb") as fp:
+                fp.write(content)
+            os.replace(f"{path}.tmp", path)
+            etag = schemas.etag(content)
+            self.stdout.write(f"{path}: {len(content)} bytes, ETag {etag}")
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.outbox import MAX_ATTEMPTS, drain
+
+
+class Command(BaseCommand):
+    help = "Create pending local users on the auth server"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS)
+        parser.add_argument(
+            "--loop", action="store_true", help="keep draining until stopped"
+        )
+        parser.add_argument(
+            "--sleep", type=float, default=1.0, help="idle wait between batches"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = drain(options["batch_size"], options["max_attempts"])
+            if sent or failed:
+                self.stdout.write(f"sent {sent} failed {failed}")
+            if not options["loop"]:
+                return
+            if not (sent or failed):
+                time.sleep(options["sleep"])
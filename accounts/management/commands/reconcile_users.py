@@ -0,0 +1,103 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.auth_state import backend_cls
+from accounts.reconcile import reconcile_batch, remote_page_results
+
+
+class Command(BaseCommand):
+    help = "Reconcile local users with the auth server user list"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--access-token", default=os.environ.get("AUTH_ACCESS_TOKEN")
+        )
+        parser.add_argument(
+            "--workers", type=int, default=4, help="remote pages fetched at once"
+        )
+        parser.add_argument("--page-size", type=int, default=None)
+        parser.add_argument(
+            "--checkpoint", help="file recording the last reconciled page"
+        )
+
+    def read_checkpoint(self, path):
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path) as checkpoint:
+            return json.load(checkpoint)["page"]
+
+    def write_checkpoint(self, path, page):
+        if not path:
+            return
+        with open(f"{path}.tmp", "w") as checkpoint:
+            json.dump({"page": page}, checkpoint)
+        os.replace(f"{path}.tmp", path)
+
+    def clear_checkpoint(self, path):
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def fetch(self, page):
+        data = backend_cls.list_remote_users(
+            self.access_token, page=page, page_size=self.page_size
+        )
+        return remote_page_results(data, self.page_size)
+
+    def handle(self, *args, **options):
+        self.access_token = options["access_token"]
+        self.page_size = options["page_size"]
+        if not self.access_token:
+            raise CommandError("--access-token or AUTH_ACCESS_TOKEN is required")
+        checkpoint = options["checkpoint"]
+        workers = options["workers"]
+        fields = backend_cls.user_fields
+
+        started = time.perf_counter()
+        first = page = self.read_checkpoint(checkpoint) + 1
+        last = first - 1
+        seen = updated = memberships = 0
+        # size of the first page, plain lists end with a shorter one
+        size = None
+        previous = None
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                # pages are fetched ahead by the pool and applied in order on
+                # this thread, so the checkpoint is always a finished prefix
+                while len(pending) < workers:
+                    pending.append((page, executor.submit(self.fetch, page)))
+                    page += 1
+                number, future = pending.popleft()
+                results, has_next = future.result()
+                usernames = [item.get("username") for item in results]
+                if usernames == previous:
+                    # the server ignores ``page`` and repeats itself
+                    results, has_next = [], False
+                previous = usernames
+                size = size or len(results)
+                if len(results) < size:
+                    has_next = False
+                if results:
+                    users, changes = reconcile_batch(results, fields)
+                    seen += len(results)
+                    updated += users
+                    memberships += changes
+                    last = number
+                    self.write_checkpoint(checkpoint, last)
+                if not has_next:
+                    # pages fetched past the end are dropped unread
+                    for _, future in pending:
+                        future.cancel()
+                    break
+        # the next run starts over from the first page
+        self.clear_checkpoint(checkpoint)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"pages {first}-{last}  users {seen}  updated {updated}  "
+            f"memberships {memberships}  {seen / elapsed:.1f} users/s"
+        )
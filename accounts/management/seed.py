@@ -0,0 +1,58 @@
+from contextlib import contextmanager
+
+from django.contrib.auth.models import Group, Permission
+from django.db import transaction
+
+from accounts.models import User
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rollback():
+    """
+    run the block in a transaction that is always rolled back
+    """
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback()
+    except Rollback:
+        pass
+
+
+def seed_accounts(users, roles, prefix="bench"):
+    """
+    bulk create ``roles`` groups sharing the permissions and ``users`` users
+    with one role each
+    """
+    permissions = list(Permission.objects.all())
+    Group.objects.bulk_create(
+        [Group(name=f"{prefix}-role-{index}") for index in range(roles)]
+    )
+    # bulk_create does not return primary keys on every backend
+    groups = list(Group.objects.filter(name__startswith=f"{prefix}-role-"))
+    for index, group in enumerate(groups):
+        group.permissions.set(permissions[index :: len(groups)])
+    User.objects.bulk_create(
+        [
+            User(
+                username=f"{prefix}-user-{index}",
+                email=f"{prefix}-user-{index}@admaren.com",
+                first_name=f"{prefix} {index}",
+            )
+            for index in range(users)
+        ]
+    )
+    created = list(User.objects.filter(username__startswith=f"{prefix}-user-"))
+    if groups:
+        through = User.groups.through
+        through.objects.bulk_create(
+            [
+                through(user_id=user.pk, group_id=groups[index % len(groups)].pk)
+                for index, user in enumerate(created)
+            ]
+        )
+    return created, groups
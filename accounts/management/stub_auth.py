@@ -0,0 +1,192 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from accounts.auth_state import backend_cls
+
+
+class StubAuthHandler(BaseHTTPRequestHandler):
+    """
+    ``login``, ``token/refresh``, ``profile`` and ``users`` of the auth server
+    """
+
+    ROUTES = {
+        ("POST", "/api/v1/login/"): "login",
+        ("POST", "/api/v1/token/refresh/"): "refresh",
+        ("GET", "/api/v1/profile/"): "profile",
+        ("GET", "/api/v1/users/"): "list_users",
+        ("POST", "/api/v1/users/"): "create_user",
+    }
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def log_message(self, format, *args):
+        pass
+
+    def dispatch(self, method):
+        stub = self.server.stub
+        url = urlsplit(self.path)
+        name = self.ROUTES.get((method, url.path))
+        stub.count(name or "unknown")
+        if stub.latency:
+            time.sleep(stub.latency)
+        if name is None:
+            return self.reply(404, {"detail": "Not found."})
+        if stub.should_fail():
+            stub.count("failed")
+            return self.reply(503, {"detail": "Service Unavailable"})
+        self.query = parse_qs(url.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        self.form = parse_qs(self.rfile.read(length).decode())
+        status, data = getattr(stub, name)(self)
+        self.reply(status, data)
+
+    def field(self, name, default=None):
+        values = self.form.get(name) or self.query.get(name)
+        return values[0] if values else default
+
+    def token_username(self):
+        _, _, raw = (self.headers.get("Authorization") or "").partition(" ")
+        try:
+            return AccessToken(raw)[api_settings.USER_ID_CLAIM]
+        except (TokenError, KeyError):
+            return None
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubAuthServer(object):
+    """
+    in-process stand-in of the auth server on a local port
+
+    Tokens are signed with the ``SIMPLE_JWT`` key, as the real server does.
+    ``latency`` seconds are added to every response and ``failure_rate`` of
+    the requests answer 503. Use it as a context manager, the auth backend is
+    pointed at the stub while it runs.
+    """
+
+    profile_fields = ["first_name", "last_name", "email", "is_active"]
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None, backend=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.backend = backend or backend_cls
+        self.users = {}
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+        self.api_url = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def add_user(self, username, password, **profile):
+        profile.setdefault("is_active", True)
+        for field in self.profile_fields:
+            profile.setdefault(field, "")
+        with self.lock:
+            self.users[username] = dict(profile, username=username, password=password)
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] += 1
+
+    def should_fail(self):
+        with self.lock:
+            return self.random.random() < self.failure_rate
+
+    def profile(self, request):
+        username = request.token_username()
+        if username not in self.users:
+            return 401, {"detail": "Given token not valid for any token type"}
+        return 200, self.profile_of(username)
+
+    def login(self, request):
+        user = self.users.get(request.field("username"))
+        if user is None or user["password"] != request.field("password"):
+            detail = "No active account found with the given credentials"
+            return 401, {"detail": detail}
+        refresh = RefreshToken()
+        refresh[api_settings.USER_ID_CLAIM] = user["username"]
+        return 200, {"refresh": str(refresh), "access": str(refresh.access_token)}
+
+    def refresh(self, request):
+        try:
+            refresh = RefreshToken(request.field("refresh", ""))
+        except TokenError:
+            return 401, {"detail": "Token is invalid or expired"}
+        return 200, {"access": str(refresh.access_token)}
+
+    def list_users(self, request):
+        if request.token_username() is None:
+            return 401, {"detail": "Given token not valid for any token type"}
+        page = int(request.field("page", 1))
+        page_size = int(request.field("page_size", 100))
+        users = sorted(self.users)
+        names = users[(page - 1) * page_size : page * page_size]
+        results = [self.profile_of(name) for name in names]
+        more = page * page_size < len(users)
+        return 200, {
+            "count": len(users),
+            "next": f"?page={page + 1}" if more else None,
+            "results": results,
+        }
+
+    def create_user(self, request):
+        if request.token_username() is None:
+            return 401, {"detail": "Given token not valid for any token type"}
+        username = request.field("username")
+        if not username or username in self.users:
+            return 400, {"detail": "A user with that username already exists."}
+        profile = {field: request.field(field, "") for field in self.profile_fields}
+        profile["is_active"] = True
+        self.add_user(username, request.field("password", ""), **profile)
+        return 201, self.profile_of(username)
+
+    def profile_of(self, username):
+        user = self.users[username]
+        return {key: value for key, value in user.items() if key != "password"}
+
+    def start(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubAuthHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.api_url = self.backend.API_URL
+        self.backend.API_URL = self.url
+        return self
+
+    def stop(self):
+        self.backend.API_URL = self.api_url
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,435 @@
+import atexit
+import bisect
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# seconds, shared by every latency histogram
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# totals of exited workers, kept so counters never go backwards
+RETIRED_SNAPSHOT = "retired.json"
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class ShardOwner(object):
+    """
+    kept in the thread local next to a shard, dropped when its thread ends
+    """
+
+
+class Metric(object):
+    """
+    values keyed by labels, kept in one shard per thread so recording never
+    waits on a lock
+
+    The shard of a finished thread is folded into ``retired``, so threads
+    started per request do not pile up shards.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.local = threading.local()
+        # id -> values of the live threads
+        self.shards = {}
+        self.retired = {}
+        # reentrant, a shard may be retired by the collector of its thread
+        self.lock = threading.RLock()
+
+    def shard(self):
+        try:
+            return self.local.values
+        except AttributeError:
+            values = self.local.values = {}
+            self.local.owner = owner = ShardOwner()
+            weakref.finalize(owner, self.retire, values)
+            with self.lock:
+                self.shards[id(values)] = values
+            return values
+
+    def retire(self, values):
+        with self.lock:
+            del self.shards[id(values)]
+            self.add_into(self.retired, values)
+
+    def merge(self, total, value):
+        return total + value
+
+    def add_into(self, totals, values):
+        for key, value in list(values.items()):
+            totals[key] = self.merge(totals[key], value) if key in totals else value
+
+    def collect(self):
+        """
+        return ``{labels: value}`` summed over the thread shards
+        """
+        with self.lock:
+            shards = list(self.shards.values())
+            totals = dict(self.retired)
+        for values in shards:
+            self.add_into(totals, values)
+        return totals
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        values = self.shard()
+        key = label_key(labels)
+        values[key] = values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    """
+    per process value, summed over the live workers
+    """
+
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """
+    fixed bucket histogram, a value is ``[count per bucket..., +Inf, sum]``
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, documentation)
+        self.buckets = tuple(buckets)
+
+    def observe(self, amount, **labels):
+        values = self.shard()
+        key = label_key(labels)
+        value = values.get(key)
+        if value is None:
+            value = values[key] = [0] * (len(self.buckets) + 2)
+        value[bisect.bisect_left(self.buckets, amount)] += 1
+        value[-1] += amount
+
+    def merge(self, total, value):
+        return [left + right for left, right in zip(total, value)]
+
+    def collect(self):
+        # shards hold the lists they update, hand out copies
+        totals = super(Histogram, self).collect()
+        return {key: list(value) for key, value in totals.items()}
+
+
+class Registry(object):
+    """
+    metrics of this process, written to ``METRICS_DIR`` so any worker can
+    expose the sum over all of them
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation):
+        return self.register(Counter(name, documentation))
+
+    def gauge(self, name, documentation):
+        return self.register(Gauge(name, documentation))
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, buckets))
+
+    def add_collector(self, collector):
+        """
+        ``collector()`` returns ``[(name, kind, documentation, {labels: value})]``
+        for values kept outside the registry
+        """
+        self.collectors.append(collector)
+
+    def snapshot(self):
+        families = {}
+        for metric in self.metrics.values():
+            family = {
+                "kind": metric.kind,
+                "help": metric.documentation,
+                "samples": metric.collect(),
+            }
+            if isinstance(metric, Histogram):
+                family["buckets"] = list(metric.buckets)
+            families[metric.name] = family
+        for collector in self.collectors:
+            for name, kind, documentation, samples in collector():
+                families[name] = {
+                    "kind": kind,
+                    "help": documentation,
+                    "samples": samples,
+                }
+        return families
+
+    def snapshot_path(self, pid=None):
+        return os.path.join(settings.METRICS_DIR, f"{pid or os.getpid()}.json")
+
+    def retired_path(self):
+        return os.path.join(settings.METRICS_DIR, RETIRED_SNAPSHOT)
+
+    def write_snapshot(self):
+        write_families(self.snapshot_path(), self.snapshot())
+
+    @contextmanager
+    def directory_lock(self):
+        with open(os.path.join(settings.METRICS_DIR, "metrics.lock"), "a") as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def retire_snapshot(self, pid):
+        """
+        fold the counters and histograms of an exited worker into the retired
+        snapshot and remove its file, its gauges are dropped
+        """
+        path = self.snapshot_path(pid)
+        with self.directory_lock():
+            families = read_families(path)
+            if families is None:
+                return
+            retired = read_families(self.retired_path()) or {}
+            merge_families(retired, families, gauges=False)
+            write_families(self.retired_path(), retired)
+            os.remove(path)
+
+    def retire(self):
+        """
+        hand the totals of this process over to the retired snapshot at exit
+        """
+        self.write_snapshot()
+        self.retire_snapshot(os.getpid())
+
+    def ensure_exporter(self):
+        """
+        write the snapshot of this worker every ``METRICS_INTERVAL`` seconds,
+        restarted in forked workers
+        """
+        if self.pid == os.getpid() or not getattr(settings, "METRICS_DIR", None):
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            # left by a killed process that had the same pid
+            self.retire_snapshot(self.pid)
+            thread = threading.Thread(
+                target=self.export, name="accounts-metrics", daemon=True
+            )
+            thread.start()
+            atexit.register(self.retire)
+
+    def export(self):
+        while True:
+            time.sleep(getattr(settings, "METRICS_INTERVAL", 5))
+            self.write_snapshot()
+
+    def worker_snapshots(self):
+        """
+        yield the families of the other live workers and the retired totals,
+        the snapshots of exited workers are retired first
+        """
+        directory = getattr(settings, "METRICS_DIR", None)
+        if not directory:
+            return
+        live = []
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            name = os.path.basename(path)[: -len(".json")]
+            if not name.isdigit() or int(name) == os.getpid():
+                continue
+            if pid_alive(int(name)):
+                live.append(path)
+            else:
+                self.retire_snapshot(int(name))
+        for path in [self.retired_path()] + live:
+            families = read_families(path)
+            if families is not None:
+                yield families
+
+    def aggregate(self):
+        """
+        return the families of this process summed with the other workers
+        and the exited ones
+        """
+        families = self.snapshot()
+        for worker in self.worker_snapshots():
+            merge_families(families, worker)
+        return families
+
+
+def read_families(path):
+    """
+    return the families of a snapshot file, ``None`` when it is missing
+    """
+    try:
+        with open(path) as fp:
+            families = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    for family in families.values():
+        family["samples"] = {
+            tuple(tuple(pair) for pair in key): value
+            for key, value in family["samples"]
+        }
+    return families
+
+
+def write_families(path, families):
+    families = {
+        name: dict(
+            family,
+            samples=[[list(key), value] for key, value in family["samples"].items()],
+        )
+        for name, family in families.items()
+    }
+    with open(f"{path}.tmp", "w") as fp:
+        json.dump(families, fp)
+    os.replace(f"{path}.tmp", path)
+
+
+def merge_families(families, other, gauges=True):
+    """
+    add the samples of ``other`` into ``families``
+    """
+    for name, family in other.items():
+        if family["kind"] == "gauge" and not gauges:
+            continue
+        merged = families.setdefault(name, dict(family, samples={}))
+        samples = merged["samples"]
+        for key, value in family["samples"].items():
+            if key not in samples:
+                samples[key] = value
+            elif isinstance(value, list):
+                samples[key] = [a + b for a, b in zip(samples[key], value)]
+            else:
+                samples[key] += value
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    labels = ",".join(
+        '{}="{}"'.format(
+            name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for name, value in pairs
+    )
+    return "{" + labels + "}"
+
+
+def render_text(families):
+    """
+    text exposition format of ``families``
+    """
+    lines = []
+    for name in sorted(families):
+        family = families[name]
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['kind']}")
+        for key, value in sorted(family["samples"].items()):
+            if family["kind"] != "histogram":
+                lines.append(f"{name}{format_labels(key)} {value}")
+                continue
+            cumulative = 0
+            bounds = [str(bound) for bound in family["buckets"]] + ["+Inf"]
+            for bound, count in zip(bounds, value[:-1]):
+                cumulative += count
+                labels = format_labels(key, [("le", bound)])
+                lines.append(f"{name}_bucket{labels} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(key)} {value[-1]}")
+            lines.append(f"{name}_count{format_labels(key)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+auth_server_latency = registry.histogram(
+    "accounts_auth_server_request_seconds",
+    "Latency of auth server requests by backend and endpoint.",
+)
+auth_server_requests = registry.counter(
+    "accounts_auth_server_requests_total",
+    "Auth server requests by backend, endpoint and status class.",
+)
+token_validations = registry.counter(
+    "accounts_token_validations_total", "JWT validations by result."
+)
+request_latency = registry.histogram(
+    "accounts_request_seconds", "Request latency by view."
+)
+request_queries = registry.histogram(
+    "accounts_request_queries", "Database queries per request by view.", COUNT_BUCKETS
+)
+requests_in_flight = registry.gauge(
+    "accounts_requests_in_flight", "Requests being served by the workers."
+)
+
+
+@contextmanager
+def remote_call(backend, endpoint):
+    """
+    time an auth server request, set ``call["status"]`` to the response status
+    """
+    call = {"status": None}
+    started = time.perf_counter()
+    try:
+        yield call
+    finally:
+        labels = {"backend": backend, "endpoint": endpoint}
+        auth_server_latency.observe(time.perf_counter() - started, **labels)
+        status = call["status"]
+        status = f"{status // 100}xx" if status else "error"
+        auth_server_requests.inc(status=status, **labels)
+
+
+def counter_collector(name, documentation, counter, labels):
+    """
+    expose a ``collections.Counter`` keyed by tuples of ``labels`` values
+    """
+
+    def collect():
+        samples = {}
+        for key, value in list(counter.items()):
+            if not isinstance(key, tuple):
+                key = (key,)
+            samples[label_key(dict(zip(labels, key)))] = value
+        return [(name, "counter", documentation, samples)]
+
+    return collect
@@ -0,0 +1,319 @@
+import hashlib
+import json
+import logging
+import re
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence, compress_string
+
+from .metrics import registry, request_latency, request_queries, requests_in_flight
+from .querybudget import (
+    QueryBudgetExceeded,
+    budget_report,
+    count_queries,
+    view_query_budget,
+)
+from .routers import replicas, use_replica
+from .timing import TimedQueries, Timings, request_timings
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+logger = logging.getLogger(__name__)
+timing_logger = logging.getLogger("accounts.timing")
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "text/",
+)
+
+
+class ReplicaRoutingMiddleware(object):
+    """
+    route reads of the accounts views to the replicas
+
+    A successful write pins the client to the primary for
+    ``REPLICA_STICKY_SECONDS`` with a cookie so it reads its own writes,
+    clients without cookies can send the ``X-Read-Primary`` header instead.
+    """
+
+    cookie_name = "read_primary"
+    header_name = "HTTP_X_READ_PRIMARY"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, "REPLICA_STICKY_SECONDS", 5)
+        self.view_modules = getattr(settings, "REPLICA_VIEW_MODULES", ["accounts."])
+
+    def __call__(self, request):
+        token = use_replica.set(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replica.reset(token)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(
+                self.cookie_name,
+                str(int(time.time()) + self.sticky_seconds),
+                max_age=self.sticky_seconds,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+    def pinned_to_primary(self, request):
+        if request.META.get(self.header_name):
+            return True
+        try:
+            return int(request.COOKIES.get(self.cookie_name, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not replicas() or request.method not in SAFE_METHODS:
+            return None
+        if not view_func.__module__.startswith(tuple(self.view_modules)):
+            return None
+        if not self.pinned_to_primary(request):
+            use_replica.set(True)
+        return None
+
+
+def accepted_encodings(header):
+    """
+    return the codings of an ``Accept-Encoding`` header with a non zero
+    quality, best first
+    """
+    codings = []
+    for position, part in enumerate(header.split(",")):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        match = re.search(r"q=([0-9.]+)", params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        if coding and quality > 0:
+            codings.append((-quality, position, coding.strip().lower()))
+    return [coding for _, _, coding in sorted(codings)]
+
+
+def brotli_sequence(sequence, quality):
+    compressor = brotli.Compressor(quality=quality)
+    for item in sequence:
+        data = compressor.process(item)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressionMiddleware(object):
+    """
+    compress text and JSON responses with brotli or gzip
+
+    The coding is negotiated from ``Accept-Encoding``, brotli is preferred
+    when installed. Bodies below ``COMPRESSION_MIN_SIZE`` bytes are sent as
+    they are and streaming responses are compressed chunk by chunk. Bodies of
+    responses with an ETag are likely to be served again, their compressed
+    form is cached by content.
+
+    Only views setting ``compress_response`` are compressed, so responses
+    carrying tokens are never exposed to BREACH style attacks.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, "COMPRESSION_MIN_SIZE", 1024)
+        self.brotli_quality = getattr(settings, "COMPRESSION_BROTLI_QUALITY", 5)
+        self.cache_alias = getattr(settings, "COMPRESSION_CACHE_ALIAS", None)
+        self.cache_timeout = getattr(settings, "COMPRESSION_CACHE_TIMEOUT", 300)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not getattr(request, "compress_response", False):
+            return response
+        return self.compress(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, "view_class", None) or getattr(
+            view_func, "cls", None
+        )
+        request.compress_response = getattr(view_class, "compress_response", False)
+        return None
+
+    def negotiate(self, request):
+        header = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        for coding in accepted_encodings(header):
+            if coding == "br" and brotli is not None:
+                return "br"
+            if coding in ("gzip", "*"):
+                return "gzip"
+            if coding == "identity":
+                return None
+        return None
+
+    def compressible(self, response):
+        if response.has_header("Content-Encoding") or response.status_code < 200:
+            return False
+        if response.status_code in (204, 304):
+            return False
+        content_type = response.get("Content-Type", "").lower()
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def compress(self, request, response):
+        if not self.compressible(response):
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+        coding = self.negotiate(request)
+        if coding is None:
+            return response
+        if response.streaming:
+            if coding == "br":
+                content = brotli_sequence(
+                    response.streaming_content, self.brotli_quality
+                )
+            else:
+                content = compress_sequence(response.streaming_content)
+            response.streaming_content = content
+            del response["Content-Length"]
+        else:
+            content = self.compressed_content(response, coding)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response["Content-Length"] = str(len(content))
+        if response.has_header("ETag"):
+            # the representation changed, only a weak match still holds
+            response["ETag"] = re.sub(r'^"', 'W/"', response["ETag"])
+        response["Content-Encoding"] = coding
+        return response
+
+    def compressed_content(self, response, coding):
+        etag = response.get("ETag")
+        if etag is None or self.cache_alias is None:
+            return self.compress_bytes(response.content, coding)
+        # keyed by content too, equal ETags of different users never collide
+        digest = hashlib.md5(response.content).hexdigest()
+        key = f"accounts:compressed:{coding}:{digest}:{etag}"
+        cache = caches[self.cache_alias]
+        content = cache.get(key)
+        if content is None:
+            content = self.compress_bytes(response.content, coding)
+            cache.set(key, content, self.cache_timeout)
+        return content
+
+    def compress_bytes(self, content, coding):
+        if coding == "br":
+            return brotli.compress(content, quality=self.brotli_quality)
+        return compress_string(content)
+
+
+class QueryBudgetMiddleware(object):
+    """
+    count the queries of each request against the ``query_budget`` of its view
+
+    Requests over budget are logged with their most repeated SQL shapes, or
+    fail with ``QueryBudgetExceeded`` when ``QUERY_BUDGET_RAISE`` is set.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.raise_exceeded = getattr(settings, "QUERY_BUDGET_RAISE", False)
+
+    def __call__(self, request):
+        with count_queries() as counter:
+            response = self.get_response(request)
+        match = getattr(request, "resolver_match", None)
+        if match is None:
+            return response
+        budget = view_query_budget(match.func, request.method)
+        if budget is None or counter.count <= budget:
+            return response
+        report = budget_report(match.view_name, budget, counter)
+        if self.raise_exceeded:
+            raise QueryBudgetExceeded(report)
+        logger.warning(report)
+        return response
+
+
+class ServerTimingMiddleware(object):
+    """
+    time token validation, auth server calls, queries and rendering of each
+    request, send them as a ``Server-Timing`` header and log them as one JSON
+    line on the ``accounts.timing`` logger
+
+    Removed from the stack unless ``SERVER_TIMING`` is set, the instrumented
+    code then only pays a context variable lookup.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "SERVER_TIMING", False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = Timings()
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    wrapper = TimedQueries(timings)
+                    stack.enter_context(connections[alias].execute_wrapper(wrapper))
+                response = self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        total = time.perf_counter() - started
+        response["Server-Timing"] = timings.header(total)
+        timing_logger.info(
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "total_ms": round(total * 1000, 3),
+                    "timings": timings.as_dict(),
+                }
+            )
+        )
+        return response
+
+
+class MetricsMiddleware(object):
+    """
+    record latency, query count and concurrency of the requests in the
+    metrics registry
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        registry.ensure_exporter()
+        requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            with count_queries() as counter:
+                response = self.get_response(request)
+        finally:
+            requests_in_flight.dec()
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unmatched"
+        request_latency.observe(time.perf_counter() - started, view=view)
+        request_queries.observe(counter.count, view=view)
+        return response
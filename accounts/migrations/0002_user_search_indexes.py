@@ -0,0 +1,64 @@
+from django.db import migrations
+
+SEARCH_COLUMNS = ["username", "email", "first_name"]
+
+# icontains/istartswith compile to UPPER("column"::text) LIKE UPPER(...) on
+# postgres, the indexes are built on that expression.
+POSTGRES_FORWARD = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"]
+POSTGRES_REVERSE = []
+for column in SEARCH_COLUMNS:
+    POSTGRES_FORWARD += [
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS accounts_user_{column}_prefix "
+        f'ON accounts_user (UPPER("{column}"::text) text_pattern_ops)',
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS accounts_user_{column}_trgm "
+        f'ON accounts_user USING gin (UPPER("{column}"::text) gin_trgm_ops)',
+    ]
+    POSTGRES_REVERSE += [
+        f"DROP INDEX CONCURRENTLY IF EXISTS accounts_user_{column}_prefix",
+        f"DROP INDEX CONCURRENTLY IF EXISTS accounts_user_{column}_trgm",
+    ]
+
+# sqlite LIKE is case insensitive, prefix matches can use NOCASE indexes.
+SQLITE_FORWARD = [
+    f"CREATE INDEX IF NOT EXISTS accounts_user_{column}_prefix "
+    f'ON accounts_user ("{column}" COLLATE NOCASE)'
+    for column in SEARCH_COLUMNS
+]
+SQLITE_REVERSE = [
+    f"DROP INDEX IF EXISTS accounts_user_{column}_prefix" for column in SEARCH_COLUMNS
+]
+
+SEARCH_INDEXES = {
+    "postgresql": (POSTGRES_FORWARD, POSTGRES_REVERSE),
+    "sqlite": (SQLITE_FORWARD, SQLITE_REVERSE),
+}
+
+
+def run_statements(schema_editor, position):
+    statements = SEARCH_INDEXES.get(schema_editor.connection.vendor)
+    if statements is None:
+        return
+    for sql in statements[position]:
+        schema_editor.execute(sql)
+
+
+def create_search_indexes(apps, schema_editor):
+    run_statements(schema_editor, 0)
+
+
+def drop_search_indexes(apps, schema_editor):
+    run_statements(schema_editor, 1)
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ("accounts", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0002_user_search_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                fields=["first_name"], name="accounts_user_first_name_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(fields=["email"], name="accounts_user_email_idx"),
+        ),
+        # role member lookups, the auto created through table only has
+        # (user_id, group_id) and single column indexes
+        migrations.RunSQL(
+            "CREATE INDEX accounts_user_groups_group_user_idx "
+            "ON accounts_user_groups (group_id, user_id)",
+            "DROP INDEX accounts_user_groups_group_user_idx",
+        ),
+    ]
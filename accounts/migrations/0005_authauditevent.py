@@ -0,0 +1,65 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0004_remoteuseroutbox"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AuthAuditEvent",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                (
+                    "event",
+                    models.CharField(
+                        choices=[
+                            ("login", "Login"),
+                            ("login_failed", "Login failed"),
+                            ("refresh", "Token refresh"),
+                            ("refresh_failed", "Token refresh failed"),
+                            ("user_created", "User created"),
+                            ("role_created", "Role created"),
+                            ("role_updated", "Role updated"),
+                            ("role_deleted", "Role deleted"),
+                            ("roles_assigned", "Roles assigned"),
+                        ],
+                        max_length=32,
+                    ),
+                ),
+                ("username", models.CharField(blank=True, max_length=150)),
+                ("actor_id", models.BigIntegerField(blank=True, null=True)),
+                ("ip_address", models.GenericIPAddressField(blank=True, null=True)),
+                ("detail", models.JSONField(blank=True, default=dict)),
+                (
+                    "occurred_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+            options={
+                "verbose_name": "Auth audit event",
+                "verbose_name_plural": "Auth audit events",
+                "db_table": "accounts_auth_audit_event",
+                "ordering": ["-occurred_at", "-id"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="authauditevent",
+            index=models.Index(fields=["occurred_at"], name="accounts_audit_time_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="authauditevent",
+            index=models.Index(
+                fields=["event", "occurred_at"], name="accounts_audit_event_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="authauditevent",
+            index=models.Index(
+                fields=["username", "occurred_at"], name="accounts_audit_user_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations, models
+
+
+def seal_pending(apps, schema_editor):
+    from accounts.outbox import SECRET_FIELDS, seal
+
+    RemoteUserOutbox = apps.get_model("accounts", "RemoteUserOutbox")
+    for entry in RemoteUserOutbox.objects.filter(status="pending"):
+        secrets = {
+            field: entry.payload.pop(field)
+            for field in SECRET_FIELDS
+            if field in entry.payload
+        }
+        if entry.access_token:
+            secrets["access_token"] = entry.access_token
+        entry.secrets = seal(secrets)
+        entry.save(update_fields=["payload", "secrets"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_authauditevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="remoteuseroutbox",
+            name="secrets",
+            field=models.TextField(blank=True),
+        ),
+        migrations.RunPython(seal_pending, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="remoteuseroutbox",
+            name="access_token",
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0006_remoteuseroutbox_secrets"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="profile_hash",
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+    ]
@@ -1,15 +1,110 @@
 from django.contrib.auth.models import AbstractUser
+from django.db import models
+from django.utils import timezone
 from core.models import AbsModel
 
 
 class User(AbsModel, AbstractUser):
     """Base user model"""
 
+    # hash of the last applied auth server profile
+    profile_hash = models.CharField(max_length=40, blank=True, editable=False)
+
     class Meta:
         verbose_name = "User"
         verbose_name_plural = "Users"
         db_table = "accounts_user"
         ordering = ["first_name"]
+        indexes = [
+            models.Index(fields=["first_name"], name="accounts_user_first_name_idx"),
+            models.Index(fields=["email"], name="accounts_user_email_idx"),
+        ]
 
     def __str__(self):
         return self.username
+
+
+class RemoteUserOutbox(AbsModel):
+    """Pending creation of a local user on the auth server"""
+
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (SENT, "Sent"), (FAILED, "Failed")]
+
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, related_name="remote_outbox"
+    )
+    payload = models.JSONField(default=dict)
+    # password and access token, encrypted with OUTBOX_ENCRYPTION_KEYS
+    secrets = models.TextField(blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name = "Remote user outbox"
+        verbose_name_plural = "Remote user outbox"
+        db_table = "accounts_remote_user_outbox"
+        indexes = [
+            models.Index(
+                fields=["status", "next_attempt_at"],
+                name="accounts_outbox_due_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.status}"
+
+
+class AuthAuditEvent(models.Model):
+    """Login, token and user management event, written in batches"""
+
+    LOGIN = "login"
+    LOGIN_FAILED = "login_failed"
+    REFRESH = "refresh"
+    REFRESH_FAILED = "refresh_failed"
+    USER_CREATED = "user_created"
+    ROLE_CREATED = "role_created"
+    ROLE_UPDATED = "role_updated"
+    ROLE_DELETED = "role_deleted"
+    ROLES_ASSIGNED = "roles_assigned"
+    EVENT_CHOICES = [
+        (LOGIN, "Login"),
+        (LOGIN_FAILED, "Login failed"),
+        (REFRESH, "Token refresh"),
+        (REFRESH_FAILED, "Token refresh failed"),
+        (USER_CREATED, "User created"),
+        (ROLE_CREATED, "Role created"),
+        (ROLE_UPDATED, "Role updated"),
+        (ROLE_DELETED, "Role deleted"),
+        (ROLES_ASSIGNED, "Roles assigned"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    event = models.CharField(max_length=32, choices=EVENT_CHOICES)
+    # kept as plain values, events outlive the users they mention
+    username = models.CharField(max_length=150, blank=True)
+    actor_id = models.BigIntegerField(null=True, blank=True)
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    detail = models.JSONField(default=dict, blank=True)
+    occurred_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Auth audit event"
+        verbose_name_plural = "Auth audit events"
+        db_table = "accounts_auth_audit_event"
+        ordering = ["-occurred_at", "-id"]
+        indexes = [
+            models.Index(fields=["occurred_at"], name="accounts_audit_time_idx"),
+            models.Index(
+                fields=["event", "occurred_at"], name="accounts_audit_event_idx"
+            ),
+            models.Index(
+                fields=["username", "occurred_at"], name="accounts_audit_user_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event} {self.username}"
@@ -0,0 +1,147 @@
+import hashlib
+import os
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+
+# drf_yasg is imported by the functions using it, it is only needed to build
+# the schema and to serve the swagger UI
+SCHEMA_FORMATS = {".json": "application/json", ".yaml": "application/yaml"}
+
+
+def schema_info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="Secure Load API",
+        default_version="v1",
+        description="Loading Computer",
+        terms_of_service="https://www.google.com/policies/terms/",
+        contact=openapi.Contact(email="info@admaren.com"),
+        license=openapi.License(name="BSD License"),
+    )
+
+
+def generate_schema(url=None):
+    """
+    build the schema of every api by introspecting the views
+    """
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    generator = OpenAPISchemaGenerator(schema_info(), url=url)
+    return generator.get_schema(request=None, public=True)
+
+
+def encode_schema(schema, extension):
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+
+    codec = OpenAPICodecJson if extension == ".json" else OpenAPICodecYaml
+    return codec(validators=[]).encode(schema)
+
+
+def schema_path(extension, directory=None):
+    return os.path.join(directory or settings.OPENAPI_SCHEMA_DIR, f"openapi{extension}")
+
+
+class PrebuiltSchemas(object):
+    """
+    schema files written by ``build_openapi_schema``, read again when they
+    change on disk
+
+    Without a file the schema is generated once per process, when drf_yasg
+    is installed.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.generated = {}
+        self.lock = threading.Lock()
+
+    def get(self, extension):
+        """
+        return ``(content, etag)``, raise ``LookupError`` when there is no
+        schema to serve
+        """
+        path = schema_path(extension)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return self.fallback(extension)
+        cached = self.files.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, "rb") as fp:
+                content = fp.read()
+            cached = self.files[path] = (mtime, content, self.etag(content))
+        return cached[1:]
+
+    def fallback(self, extension):
+        with self.lock:
+            if extension not in self.generated:
+                try:
+                    content = encode_schema(generate_schema(), extension)
+                except ImportError:
+                    raise LookupError(extension)
+                self.generated[extension] = (content, self.etag(content))
+        return self.generated[extension]
+
+    def etag(self, content):
+        return quote_etag(hashlib.sha256(content).hexdigest()[:32])
+
+
+schemas = PrebuiltSchemas()
+
+
+def openapi_schema_view(request, format):
+    """
+    the prebuilt schema with an ETag, never introspects when the file exists
+    """
+    try:
+        content, etag = schemas.get(format)
+    except LookupError:
+        raise Http404("No schema, run build_openapi_schema.")
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH", "")
+    # weak comparison, compressed responses carry the weak form
+    etags = [tag.replace("W/", "", 1) for tag in parse_etags(if_none_match)]
+    if etag in etags:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type=SCHEMA_FORMATS[format])
+    response["ETag"] = etag
+    response["Cache-Control"] = f"public, max-age={settings.OPENAPI_SCHEMA_MAX_AGE}"
+    return response
+
+
+@lru_cache(maxsize=None)
+def swagger_ui():
+    from drf_yasg import openapi
+    from drf_yasg.generators import OpenAPISchemaGenerator
+    from drf_yasg.views import get_schema_view
+    from rest_framework import permissions
+
+    class PageGenerator(OpenAPISchemaGenerator):
+        # the page only shows the title, swagger-ui loads SPEC_URL itself
+        def get_schema(self, request=None, public=False):
+            return openapi.Swagger(
+                info=self.info,
+                _url=self.url,
+                _version=self.version,
+                paths=openapi.Paths(paths={}),
+            )
+
+    schema_view = get_schema_view(
+        schema_info(),
+        public=True,
+        generator_class=PageGenerator,
+        permission_classes=(permissions.AllowAny,),
+    )
+    return schema_view.with_ui("swagger", cache_timeout=0)
+
+
+def swagger_ui_view(request, *args, **kwargs):
+    """
+    swagger UI, drf_yasg is loaded on the first request
+    """
+    return swagger_ui()(request, *args, **kwargs)
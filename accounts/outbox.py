@@ -0,0 +1,190 @@
+import base64
+import hashlib
+import json
+import random
+from datetime import timedelta
+from functools import lru_cache
+
+from cryptography.fernet import Fernet, MultiFernet
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .auth_state import auth_handler
+from .backends import AuthServerError
+from .models import RemoteUserOutbox
+
+# rows claimed by a worker are hidden from the others for this long
+LEASE = timedelta(minutes=5)
+BACKOFF_BASE = 2
+BACKOFF_MAX = 3600
+MAX_ATTEMPTS = 8
+# request fields kept encrypted while the row waits
+SECRET_FIELDS = ("password",)
+
+
+def outbox_payload(data):
+    """
+    return request data as a JSON serializable dict, QueryDict lists with a
+    single value are flattened
+    """
+    if hasattr(data, "lists"):
+        return {
+            key: values if len(values) > 1 else values[0]
+            for key, values in data.lists()
+        }
+    return dict(data)
+
+
+@lru_cache(maxsize=None)
+def fernet():
+    """
+    keys of ``OUTBOX_ENCRYPTION_KEYS``, the first one encrypts, without keys
+    one is derived from ``SECRET_KEY``
+    """
+    keys = getattr(settings, "OUTBOX_ENCRYPTION_KEYS", None)
+    if not keys:
+        digest = hashlib.sha256(settings.SECRET_KEY.encode()).digest()
+        keys = [base64.urlsafe_b64encode(digest)]
+    return MultiFernet([Fernet(key) for key in keys])
+
+
+def seal(secrets):
+    return fernet().encrypt(json.dumps(secrets).encode()).decode()
+
+
+def unseal(token):
+    if not token:
+        return {}
+    return json.loads(fernet().decrypt(token.encode()))
+
+
+def enqueue_remote_user(user, data, access_token):
+    """
+    record the remote creation of ``user``, call inside the transaction that
+    saves the user
+
+    The password and the access token are stored encrypted, the token of the
+    creator is only kept when there is no service account to deliver with.
+    """
+    payload = outbox_payload(data)
+    secrets = {
+        field: payload.pop(field) for field in SECRET_FIELDS if field in payload
+    }
+    if access_token and not getattr(settings, "AUTH_SERVICE_USERNAME", ""):
+        secrets["access_token"] = access_token
+    return RemoteUserOutbox.objects.create(
+        user=user, payload=payload, secrets=seal(secrets)
+    )
+
+
+def backoff(attempts):
+    """
+    exponential backoff in seconds with full jitter
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE ** attempts))
+
+
+def claim_batch(batch_size):
+    """
+    lease a batch of due rows, other workers skip them until the lease ends
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        entries = list(
+            RemoteUserOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status=RemoteUserOutbox.PENDING, next_attempt_at__lte=now)
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        pks = [entry.pk for entry in entries]
+        RemoteUserOutbox.objects.filter(pk__in=pks).update(next_attempt_at=now + LEASE)
+    return entries
+
+
+def already_exists(error):
+    """
+    whether the auth server refused the user because an earlier attempt
+    already created it
+    """
+    if error.remote_status == 409:
+        return True
+    return error.remote_status == 400 and "already exists" in error.remote_detail
+
+
+def outbox_idempotency_key(entry):
+    return f"accounts-outbox-{entry.pk}"
+
+
+def deliver(entry, max_attempts=MAX_ATTEMPTS):
+    """
+    create the remote user, on failure schedule a retry or give up
+
+    The service account is used when set, the token of the creator would
+    expire before the later retries. Every attempt of a row sends the same
+    idempotency key, an attempt answered with "already exists" was preceded
+    by one that got through.
+    """
+    try:
+        secrets = unseal(entry.secrets)
+        access_token = secrets.pop("access_token", "")
+        access_token = auth_handler.service_access_token() or access_token
+        auth_handler.backend.create_remote_user(
+            access_token,
+            auth_handler.REQUEST_METHOD,
+            data=dict(entry.payload, **secrets),
+            idempotency_key=outbox_idempotency_key(entry),
+        )
+    except AuthServerError as e:
+        if already_exists(e):
+            mark_sent(entry)
+        else:
+            schedule_retry(entry, e, max_attempts)
+    except Exception as e:
+        schedule_retry(entry, e, max_attempts)
+    else:
+        mark_sent(entry)
+    if entry.status != RemoteUserOutbox.PENDING:
+        # the password is kept only while needed
+        entry.payload = {}
+        entry.secrets = ""
+    entry.save(
+        update_fields=[
+            "status",
+            "attempts",
+            "last_error",
+            "payload",
+            "secrets",
+            "next_attempt_at",
+            "last_updated",
+        ]
+    )
+    return entry.status == RemoteUserOutbox.SENT
+
+
+def mark_sent(entry):
+    entry.status = RemoteUserOutbox.SENT
+    entry.attempts += 1
+    entry.last_error = ""
+
+
+def schedule_retry(entry, error, max_attempts):
+    entry.attempts += 1
+    entry.last_error = str(error)
+    if entry.attempts >= max_attempts:
+        entry.status = RemoteUserOutbox.FAILED
+    entry.next_attempt_at = timezone.now() + timedelta(
+        seconds=backoff(entry.attempts)
+    )
+
+
+def drain(batch_size=100, max_attempts=MAX_ATTEMPTS):
+    """
+    deliver one batch, return ``(sent, failed)`` counts
+    """
+    sent = failed = 0
+    for entry in claim_batch(batch_size):
+        if deliver(entry, max_attempts):
+            sent += 1
+        else:
+            failed += 1
+    return sent, failed
@@ -0,0 +1,140 @@
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import cache
+from rest_framework.permissions import DjangoModelPermissions
+
+from .models import User
+from .versions import bump_counter, get_counter, on_commit
+
+GENERATION_KEY = "accounts:permission_generation"
+INDEX_KEY = "accounts:permission_index:{}"
+BITS_KEY = "accounts:permission_bits:{}:{}"
+
+_index = (None, {})
+
+
+def permission_generation():
+    """
+    return the generation every cached permission index and bitset belongs to
+    """
+    return get_counter(GENERATION_KEY)
+
+
+def bump_permission_generation():
+    """
+    drop every cached index and bitset at once, when the transaction commits
+    """
+    on_commit(bump_counter, GENERATION_KEY)
+
+
+def invalidate_user_permissions(*user_pks):
+    """
+    drop the cached bitsets of ``user_pks`` when the transaction commits
+    """
+    on_commit(delete_user_permissions, *user_pks)
+
+
+def delete_user_permissions(*user_pks):
+    generation = permission_generation()
+    cache.delete_many([BITS_KEY.format(generation, pk) for pk in user_pks])
+
+
+def permission_index():
+    """
+    return ``{"app_label.codename": bit}``, the bit of a permission is its pk
+    so the index is stable across processes
+    """
+    global _index
+    generation = permission_generation()
+    if _index[0] == generation:
+        return _index[1]
+    key = INDEX_KEY.format(generation)
+    index = cache.get(key)
+    if index is None:
+        rows = Permission.objects.values_list(
+            "content_type__app_label", "codename", "pk"
+        )
+        index = {f"{app_label}.{codename}": pk for app_label, codename, pk in rows}
+        cache.set(key, index, None)
+    _index = (generation, index)
+    return index
+
+
+def compile_permission_bits(user):
+    """
+    OR the bits of every permission granted through groups or directly
+    """
+    bits = 0
+    pks = Group.permissions.through.objects.filter(
+        group__user=user
+    ).values_list("permission_id", flat=True)
+    for pk in pks:
+        bits |= 1 << pk
+    pks = User.user_permissions.through.objects.filter(user=user).values_list(
+        "permission_id", flat=True
+    )
+    for pk in pks:
+        bits |= 1 << pk
+    return bits
+
+
+def permission_bits(user):
+    """
+    return the effective permission bitset of the user, cached per user and
+    recompiled only after group or permission changes
+    """
+    generation = permission_generation()
+    cached = getattr(user, "_permission_bits", None)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+    key = BITS_KEY.format(generation, user.pk)
+    bits = cache.get(key)
+    if bits is None:
+        bits = compile_permission_bits(user)
+        cache.set(key, bits, None)
+    user._permission_bits = (generation, bits)
+    return bits
+
+
+def has_permissions(user, perms):
+    """
+    bit test replacement of ``user.has_perms`` for ``app_label.codename`` perms
+    """
+    if not user or not user.is_active:
+        return False
+    if user.is_superuser:
+        return True
+    index = permission_index()
+    mask = 0
+    for perm in perms:
+        if perm not in index:
+            return False
+        mask |= 1 << index[perm]
+    return permission_bits(user) & mask == mask
+
+
+class BitsetPermission(DjangoModelPermissions):
+    """
+    model permissions checked against the cached permission bitset
+
+    ``required_permissions`` on the view replaces the model perms map, either
+    a list of perms or a dict of request method to perms.
+    """
+
+    def get_view_permissions(self, request, view):
+        required = getattr(view, "required_permissions", None)
+        if required is None:
+            queryset = self._queryset(view)
+            return self.get_required_permissions(request.method, queryset.model)
+        if isinstance(required, dict):
+            return required.get(request.method, [])
+        return required
+
+    def has_permission(self, request, view):
+        if not request.user or (
+            not request.user.is_authenticated and self.authenticated_users_only
+        ):
+            return False
+        if getattr(view, "_ignore_model_permissions", False):
+            return True
+        perms = self.get_view_permissions(request, view)
+        return has_permissions(request.user, perms)
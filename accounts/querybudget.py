@@ -0,0 +1,85 @@
+import re
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+IN_LIST = re.compile(r"\((?:\s*%s\s*,)+\s*%s\s*\)")
+# %s placeholders aside, literals can still be inlined by the ORM
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def sql_shape(sql):
+    """
+    ``sql`` with literals and IN lists folded, queries of a N+1 loop share
+    one shape
+    """
+    return LITERALS.sub("?", IN_LIST.sub("(...)", sql))
+
+
+class QueryCounter(object):
+    """
+    database execute wrapper counting the statements it sees
+    """
+
+    def __init__(self):
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.statements[sql] += 1
+        return execute(sql, params, many, context)
+
+    @property
+    def count(self):
+        return sum(self.statements.values())
+
+    def duplicates(self):
+        """
+        return ``[(shape, count)]`` of the shapes run more than once, most
+        repeated first
+        """
+        shapes = Counter()
+        for sql, count in self.statements.items():
+            shapes[sql_shape(sql)] += count
+        return [(shape, count) for shape, count in shapes.most_common() if count > 1]
+
+
+@contextmanager
+def count_queries(aliases=None):
+    """
+    count the queries run on ``aliases`` (every database by default) by the
+    current thread
+    """
+    counter = QueryCounter()
+    with ExitStack() as stack:
+        for alias in aliases or connections:
+            stack.enter_context(connections[alias].execute_wrapper(counter))
+        yield counter
+
+
+def view_query_budget(func, method):
+    """
+    return the ``query_budget`` of the view behind ``func`` for ``method``
+
+    The budget is a number for every method or a dict keyed by viewset action
+    or request method.
+    """
+    view_class = getattr(func, "view_class", None) or getattr(func, "cls", None)
+    budget = getattr(view_class, "query_budget", None)
+    if not isinstance(budget, dict):
+        return budget
+    action = (getattr(func, "actions", None) or {}).get(method.lower())
+    if action in budget:
+        return budget[action]
+    return budget.get(method)
+
+
+def budget_report(name, budget, counter):
+    lines = [f"{name} ran {counter.count} queries, budget {budget}"]
+    for shape, count in counter.duplicates()[:5]:
+        lines.append(f"  {count}x {shape}")
+    return "\n".join(lines)
@@ -0,0 +1,149 @@
+from collections import defaultdict
+
+from django.contrib.auth.models import Group, Permission
+
+from .models import User
+from .serializers import (
+    GroupsGetDetailSerializer,
+    PermissionSerializer,
+    UsersListSerializer,
+    nested_expand,
+)
+
+
+class Relation(object):
+    """
+    many to many relation read straight from the through table
+    """
+
+    def __init__(self, name, through, source, target, ordering, reader_class):
+        self.name = name
+        self.through = through
+        self.source = source
+        self.target = target
+        self.ordering = ordering
+        self.reader_class = reader_class
+
+    def fetch(self, pks, expand):
+        """
+        return ``{source pk: [target pk or nested data, ...]}``
+        """
+        pairs = (
+            self.through.objects.filter(**{f"{self.source}__in": pks})
+            .order_by(*self.ordering)
+            .values_list(self.source, self.target)
+        )
+        related = defaultdict(list)
+        for source, target in pairs:
+            related[source].append(target)
+        if expand is None or self.name in expand:
+            reader = self.reader_class(expand=nested_expand(expand, self.name))
+            targets = {pk for pks in related.values() for pk in pks}
+            rows = reader.read_pks(targets)
+            for source, pks in related.items():
+                related[source] = [rows[pk] for pk in pks if pk in rows]
+        return related
+
+
+class FastReader(object):
+    """
+    read only replacement of a list serializer working on ``values_list`` rows
+
+    The output of ``serializer_class`` is reproduced field by field, the plan
+    mapping tuple positions and relations to fields is compiled once per
+    reader.
+    """
+
+    model = None
+    serializer_class = None
+    # output field -> values() lookup
+    columns = {}
+    # output field -> Relation
+    relations = {}
+
+    def __init__(self, fields=None, expand=None):
+        self.expand = expand
+        self.lookups = ["pk"]
+        self.plan = []
+        for name in self.serializer_class.Meta.fields:
+            if fields is not None and name not in fields:
+                continue
+            if name in self.relations:
+                self.plan.append((name, None))
+            else:
+                self.plan.append((name, len(self.lookups)))
+                self.lookups.append(self.columns.get(name, name))
+
+    def read(self, rows):
+        """
+        map rows fetched with ``values_list(*self.lookups)`` to dicts
+        """
+        pks = [row[0] for row in rows]
+        related = {
+            name: self.relations[name].fetch(pks, self.expand)
+            for name, index in self.plan
+            if index is None
+        }
+        data = []
+        for row in rows:
+            item = {}
+            for name, index in self.plan:
+                if index is None:
+                    item[name] = related[name].get(row[0], [])
+                else:
+                    item[name] = row[index]
+            data.append(item)
+        return data
+
+    def read_pks(self, pks):
+        """
+        return ``{pk: data}`` for the given primary keys
+        """
+        rows = self.model.objects.filter(pk__in=pks).values_list(*self.lookups)
+        rows = list(rows)
+        return dict(zip((row[0] for row in rows), self.read(rows)))
+
+
+class PermissionReader(FastReader):
+    model = Permission
+    serializer_class = PermissionSerializer
+    columns = {
+        "content_id": "content_type_id",
+        "app_label": "content_type__app_label",
+        "app_model": "content_type__model",
+    }
+
+
+class GroupReader(FastReader):
+    model = Group
+    serializer_class = GroupsGetDetailSerializer
+    relations = {
+        "permissions": Relation(
+            "permissions",
+            Group.permissions.through,
+            "group_id",
+            "permission_id",
+            [
+                "permission__content_type__app_label",
+                "permission__content_type__model",
+                "permission__codename",
+            ],
+            PermissionReader,
+        ),
+    }
+
+
+class UserReader(FastReader):
+    model = User
+    serializer_class = UsersListSerializer
+    relations = {
+        "roles": Relation(
+            # groups have no model ordering, serializers sort them by pk
+            "roles",
+            User.groups.through,
+            "user_id",
+            "group_id",
+            ["group_id"],
+            GroupReader,
+        ),
+    }
@@ -0,0 +1,91 @@
+from collections import defaultdict
+
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.utils import timezone
+
+from .models import User
+from .permissions import invalidate_user_permissions
+from .versions import bump_data_generation, bump_user_version
+
+
+def remote_page_results(data, page_size=None):
+    """
+    return ``(results, has next page)`` of a paginated or plain list response
+
+    A plain list ends with an empty page or one shorter than ``page_size``.
+    """
+    if isinstance(data, dict):
+        return data.get("results", []), bool(data.get("next"))
+    if page_size:
+        return data, len(data) >= page_size
+    return data, bool(data)
+
+
+def reconcile_roles(users, remote):
+    """
+    make the role memberships of ``users`` match the remote role names, roles
+    unknown locally are ignored
+    """
+    through = User.groups.through
+    groups = dict(Group.objects.values_list("name", "pk"))
+    current = defaultdict(set)
+    pairs = through.objects.filter(user__in=users).values_list("user_id", "group_id")
+    for user_id, group_id in pairs:
+        current[user_id].add(group_id)
+    added, removed = [], defaultdict(set)
+    for user in users:
+        roles = remote[user.username].get("roles")
+        if roles is None:
+            continue
+        names = [role["name"] if isinstance(role, dict) else role for role in roles]
+        wanted = {groups[name] for name in names if name in groups}
+        for group_id in wanted - current[user.pk]:
+            added.append(through(user_id=user.pk, group_id=group_id))
+        for group_id in current[user.pk] - wanted:
+            removed[group_id].add(user.pk)
+    through.objects.bulk_create(added)
+    for group_id, user_ids in removed.items():
+        through.objects.filter(group_id=group_id, user_id__in=user_ids).delete()
+    # bulk through table writes send no m2m_changed signals
+    changed = {pair.user_id for pair in added}
+    changed.update(*removed.values())
+    invalidate_user_permissions(*changed)
+    bump_user_version(*changed)
+    if changed:
+        bump_data_generation()
+    return len(added) + sum(len(user_ids) for user_ids in removed.values())
+
+
+def reconcile_batch(remote_users, fields):
+    """
+    apply the differences between remote users and local rows, keyed by
+    username, with one bulk_update
+
+    Return ``(updated users, membership changes)``.
+    """
+    remote = {item["username"]: item for item in remote_users if item.get("username")}
+    users = list(User.objects.filter(username__in=remote).only("username", *fields))
+    changed_users, changed_fields = [], set()
+    now = timezone.now()
+    for user in users:
+        data = remote[user.username]
+        dirty = False
+        for field in fields:
+            if field in data and getattr(user, field) != data[field]:
+                setattr(user, field, data[field])
+                changed_fields.add(field)
+                dirty = True
+        if dirty:
+            user.last_updated = now
+            changed_users.append(user)
+    with transaction.atomic():
+        if changed_users:
+            User.objects.bulk_update(
+                changed_users, sorted(changed_fields) + ["last_updated"]
+            )
+            # bulk_update sends no post_save signals
+            bump_user_version(*[user.pk for user in changed_users])
+            bump_data_generation()
+        memberships = reconcile_roles(users, remote)
+    return len(changed_users), memberships
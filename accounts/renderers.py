@@ -0,0 +1,52 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .timing import timed
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+ORJSON_OPTIONS = 0
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+
+def default(obj):
+    """
+    types orjson does not know (Decimal, lazy strings, querysets, ...) are
+    converted the same way DRF's JSONEncoder does
+    """
+    return JSONEncoder().default(obj)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON renderer backed by orjson, falls back to the stdlib renderer when
+    orjson is not installed or an indented response is requested.
+
+    datetime, date, time and UUID are encoded natively, the output matches
+    ``JSONRenderer`` with the default compact and unicode settings.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed("render"):
+            return self.encode(data, accepted_media_type, renderer_context)
+
+    def encode(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super(FastJSONRenderer, self).render(
+                data, accepted_media_type, renderer_context
+            )
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super(FastJSONRenderer, self).render(
+                data, accepted_media_type, renderer_context
+            )
+        ret = orjson.dumps(data, default=default, option=ORJSON_OPTIONS)
+        # same escaping as JSONRenderer, these are invalid in javascript
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028")
+            ret = ret.replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
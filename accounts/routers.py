@@ -0,0 +1,34 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# set by ReplicaRoutingMiddleware for reads that may go to a replica
+use_replica = ContextVar("use_replica", default=False)
+
+
+def replicas():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+class ReplicaRouter(object):
+    """
+    send reads to a random replica while the request allows it, every write
+    and every other read goes to the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if aliases and use_replica.get():
+            return random.choice(aliases)
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas mirror the primary, objects are comparable across them
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()
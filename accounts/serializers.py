@@ -1,8 +1,14 @@
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import PasswordField
 from django.contrib.auth.models import Group
+from .audit import client_ip
 from .auth_state import auth_handler
-from .models import User
+from .models import AuthAuditEvent, RemoteUserOutbox, User
 import requests
 from rest_framework import status
 from django.contrib.auth.models import Permission
@@ -22,13 +28,92 @@ class HoppeServerError(APIException):
     default_code = "hoppe_server_error"
 
 
+def query_param_set(context, name):
+    """
+    return a comma separated query param as a set, ``None`` when not sent
+    """
+    if name in context:
+        return context[name]
+    request = context.get("request")
+    value = getattr(request, "query_params", {}).get(name)
+    if value is None:
+        return None
+    return {item.strip() for item in value.split(",") if item.strip()}
+
+
+def nested_expand(expand, field):
+    """
+    strip ``field.`` from the expand paths that belong to a nested relation
+    """
+    if expand is None:
+        return None
+    prefix = f"{field}."
+    return {item[len(prefix) :] for item in expand if item.startswith(prefix)}
+
+
+class SparseFieldsMixin(object):
+    """
+    restrict fields with ``?fields=`` and nested relations with ``?expand=``
+
+    Without ``expand`` every relation is embedded, relations left out of it
+    are rendered as a list of ids.
+    """
+
+    # field name -> (model relation, nested serializer class)
+    expandable_fields = {}
+    # lookups every row of this serializer needs
+    related_lookups = []
+
+    def __init__(self, *args, **kwargs):
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        self.expand = query_param_set(self.context, "expand")
+        fields = query_param_set(self.context, "fields")
+        if fields is not None:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+    @classmethod
+    def get_prefetch_lookups(cls, fields=None, expand=None):
+        """
+        return prefetch lookups for the requested fields and relations only
+        """
+        lookups = list(cls.related_lookups)
+        for field, (relation, serializer) in cls.expandable_fields.items():
+            if fields is not None and field not in fields:
+                continue
+            lookups.append(relation)
+            if expand is None or field in expand:
+                nested = serializer.get_prefetch_lookups(
+                    expand=nested_expand(expand, field)
+                )
+                lookups.extend(f"{relation}__{lookup}" for lookup in nested)
+        return lookups
+
+    def expand_field(self, field, manager):
+        """
+        return nested data of an expanded relation, ids otherwise
+
+        Related objects without a model ordering come in pk order, as the fast
+        readers return them.
+        """
+        related = manager.all()
+        if not related.ordered:
+            related = sorted(related, key=attrgetter("pk"))
+        if self.expand is not None and field not in self.expand:
+            return [obj.pk for obj in related]
+        serializer = self.expandable_fields[field][1]
+        context = {"expand": nested_expand(self.expand, field)}
+        return serializer(related, many=True, context=context).data
+
+
 class LoginSerializer(serializers.Serializer):
     username = serializers.CharField()
     password = PasswordField()
 
     def validate(self, attrs):
         data = super().validate(attrs)
-        aut_response = auth_handler.login(**data)
+        ip_address = client_ip(self.context.get("request"))
+        aut_response = auth_handler.login(**data, ip_address=ip_address)
         return aut_response
 
 
@@ -37,71 +122,78 @@ class RefreshTokenSerializer(serializers.Serializer):
 
     def validate(self, attrs):
         data = super().validate(attrs)
-        aut_response = auth_handler.refresh(**data)
+        ip_address = client_ip(self.context.get("request"))
+        aut_response = auth_handler.refresh(**data, ip_address=ip_address)
         return aut_response
 
 
-class GroupsGetDetailSerializer(serializers.ModelSerializer):
+class PermissionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     list users data serializes
     """
 
-    permissions = serializers.SerializerMethodField()
+    app_label = serializers.SerializerMethodField()
+    app_model = serializers.SerializerMethodField()
+    content_id = serializers.SerializerMethodField()
+
+    related_lookups = ["content_type"]
 
     class Meta:
-        model = Group
-        fields = ["id", "name", "permissions"]
-        read_only_field = ["id"]
+        model = Permission
+        fields = ["id", "name", "codename", "content_id", "app_label", "app_model"]
+        read_only_field = "__all__"
 
-    def get_permissions(self, instance):
-        return PermissionSerializer(instance.permissions, many=True).data
+    def get_app_label(self, instance):
+        return instance.content_type.app_label
 
+    def get_app_model(self, instance):
+        return instance.content_type.model
 
-class GroupsCreateUpdateSerializer(serializers.ModelSerializer):
+    def get_content_id(self, instance):
+        return instance.content_type.id
+
+
+class GroupsGetDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     list users data serializes
     """
 
+    permissions = serializers.SerializerMethodField()
+
+    expandable_fields = {"permissions": ("permissions", PermissionSerializer)}
+
     class Meta:
         model = Group
         fields = ["id", "name", "permissions"]
         read_only_field = ["id"]
 
-    def to_representation(self, instance):
-        return GroupsGetDetailSerializer(instance).data
+    def get_permissions(self, instance):
+        return self.expand_field("permissions", instance.permissions)
 
 
-class PermissionSerializer(serializers.ModelSerializer):
+class GroupsCreateUpdateSerializer(serializers.ModelSerializer):
     """
     list users data serializes
     """
 
-    app_label = serializers.SerializerMethodField()
-    app_model = serializers.SerializerMethodField()
-    content_id = serializers.SerializerMethodField()
-
     class Meta:
-        model = Permission
-        fields = ["id", "name", "codename", "content_id", "app_label", "app_model"]
-        read_only_field = "__all__"
-
-    def get_app_label(self, instance):
-        return instance.content_type.app_label
-
-    def get_app_model(self, instance):
-        return instance.content_type.model
+        model = Group
+        fields = ["id", "name", "permissions"]
+        read_only_field = ["id"]
 
-    def get_content_id(self, instance):
-        return instance.content_type.id
+    def to_representation(self, instance):
+        return GroupsGetDetailSerializer(instance).data
 
 
-class UserDetailSerializer(serializers.ModelSerializer):
+class UserDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     user profile information serializes
     """
 
     roles = serializers.SerializerMethodField()
 
+    expandable_fields = {"roles": ("groups", GroupsGetDetailSerializer)}
+
     class Meta:
         model = User
         fields = [
@@ -118,7 +210,7 @@ class UserDetailSerializer(serializers.ModelSerializer):
         """
         return user roles
         """
-        return GroupsGetDetailSerializer(instance.groups, many=True).data
+        return self.expand_field("roles", instance.groups)
 
 
 class UserCreateSerializer(serializers.ModelSerializer):
@@ -148,13 +240,15 @@ class UserCreateSerializer(serializers.ModelSerializer):
         return data
 
 
-class UsersListSerializer(serializers.ModelSerializer):
+class UsersListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     list users data serializes
     """
 
     roles = serializers.SerializerMethodField()
 
+    expandable_fields = {"roles": ("groups", GroupsGetDetailSerializer)}
+
     class Meta:
         model = User
         fields = [
@@ -172,7 +266,7 @@ class UsersListSerializer(serializers.ModelSerializer):
         """
         return user roles
         """
-        return GroupsGetDetailSerializer(instance.groups, many=True).data
+        return self.expand_field("roles", instance.groups)
 
 
 class RetrieveUpdateSerializer(serializers.ModelSerializer):
@@ -244,3 +338,175 @@ class RetrieveUpdateSerializer(serializers.ModelSerializer):
         user.set_password(password)
         user.save()
         return user
+
+
+class RemoteUserStatusSerializer(serializers.ModelSerializer):
+    """
+    remote user creation status serializes
+    """
+
+    class Meta:
+        model = RemoteUserOutbox
+        fields = ["status", "attempts", "last_error", "next_attempt_at", "last_updated"]
+        read_only_field = "__all__"
+
+
+def bulk_update_relation(
+    through, group_field, target_field, model, groups, add, remove
+):
+    """
+    add and remove ``model`` rows on every group with bulk through table
+    writes, sending the m2m_changed signals ``group.<relation>.add`` would
+
+    Return ``(added, removed)`` through rows.
+    """
+    added = removed = 0
+    if add:
+        existing = set(
+            through.objects.filter(
+                **{f"{group_field}__in": groups, f"{target_field}__in": add}
+            ).values_list(group_field, target_field)
+        )
+        rows = {}
+        for group in groups:
+            rows[group] = [pk for pk in add if (group.pk, pk) not in existing]
+        through.objects.bulk_create(
+            [
+                through(**{group_field: group.pk, target_field: pk})
+                for group, pks in rows.items()
+                for pk in pks
+            ]
+        )
+        added = sum(len(pks) for pks in rows.values())
+    if remove:
+        removed, _ = through.objects.filter(
+            **{f"{group_field}__in": groups, f"{target_field}__in": remove}
+        ).delete()
+    reverse = model is User
+    for group in groups:
+        for action, pks in (("post_add", add), ("post_remove", remove)):
+            if pks:
+                m2m_changed.send(
+                    sender=through,
+                    instance=group,
+                    action=action,
+                    reverse=reverse,
+                    model=model,
+                    pk_set=set(pks),
+                    using=through.objects.db,
+                )
+    return added, removed
+
+
+class BulkRoleAssignmentSerializer(serializers.Serializer):
+    """
+    add or remove many users and permissions on one or more roles
+    """
+
+    roles = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+    add_users = serializers.ListField(child=serializers.IntegerField(), default=list)
+    remove_users = serializers.ListField(
+        child=serializers.IntegerField(), default=list
+    )
+    add_permissions = serializers.ListField(
+        child=serializers.IntegerField(), default=list
+    )
+    remove_permissions = serializers.ListField(
+        child=serializers.IntegerField(), default=list
+    )
+
+    RELATIONS = {
+        "roles": Group,
+        "add_users": User,
+        "remove_users": User,
+        "add_permissions": Permission,
+        "remove_permissions": Permission,
+    }
+
+    def validate(self, attrs):
+        errors = {}
+        for field, model in self.RELATIONS.items():
+            pks = set(attrs[field])
+            found = set(model.objects.filter(pk__in=pks).values_list("pk", flat=True))
+            if pks - found:
+                errors[field] = [f"Invalid pk {pk}" for pk in sorted(pks - found)]
+            attrs[field] = sorted(pks)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
+
+    def create(self, validated_data):
+        groups = list(Group.objects.filter(pk__in=validated_data["roles"]))
+        with transaction.atomic():
+            users_added, users_removed = bulk_update_relation(
+                User.groups.through,
+                "group_id",
+                "user_id",
+                User,
+                groups,
+                validated_data["add_users"],
+                validated_data["remove_users"],
+            )
+            permissions_added, permissions_removed = bulk_update_relation(
+                Group.permissions.through,
+                "group_id",
+                "permission_id",
+                Permission,
+                groups,
+                validated_data["add_permissions"],
+                validated_data["remove_permissions"],
+            )
+        return {
+            "roles": len(groups),
+            "users_added": users_added,
+            "users_removed": users_removed,
+            "permissions_added": permissions_added,
+            "permissions_removed": permissions_removed,
+        }
+
+
+class BatchItemSerializer(serializers.Serializer):
+    """
+    one sub-request of a batch
+    """
+
+    method = serializers.ChoiceField(
+        choices=["GET", "HEAD", "OPTIONS", "POST", "PUT", "PATCH", "DELETE"],
+        default="GET",
+    )
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False)
+
+
+class BatchSerializer(serializers.Serializer):
+    """
+    sub-requests dispatched in one round-trip
+    """
+
+    requests = BatchItemSerializer(many=True, allow_empty=False)
+
+    def validate_requests(self, value):
+        limit = getattr(settings, "BATCH_MAX_REQUESTS", 20)
+        if len(value) > limit:
+            raise serializers.ValidationError(
+                f"Ensure this field has no more than {limit} elements."
+            )
+        return value
+
+
+class AuthAuditEventSerializer(serializers.ModelSerializer):
+    """
+    audit event list serializes
+    """
+
+    class Meta:
+        model = AuthAuditEvent
+        fields = [
+            "id",
+            "event",
+            "username",
+            "actor_id",
+            "ip_address",
+            "detail",
+            "occurred_at",
+        ]
@@ -0,0 +1,55 @@
+from django.contrib.auth.models import Group, Permission
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import User
+from .permissions import bump_permission_generation, invalidate_user_permissions
+from .versions import bump_data_generation, bump_roles_version, bump_user_version
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def user_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    bump_data_generation()
+    if not reverse:
+        invalidate_user_permissions(instance.pk)
+        bump_user_version(instance.pk)
+    elif pk_set:
+        # memberships changed from the group or permission side
+        invalidate_user_permissions(*pk_set)
+        bump_user_version(*pk_set)
+    else:
+        bump_permission_generation()
+        bump_roles_version()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(sender, action, **kwargs):
+    if action.startswith("post_"):
+        bump_permission_generation()
+        bump_roles_version()
+        bump_data_generation()
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def permissions_changed(sender, **kwargs):
+    bump_permission_generation()
+    bump_roles_version()
+    bump_data_generation()
+
+
+@receiver(post_save, sender=Group)
+def group_changed(sender, **kwargs):
+    bump_roles_version()
+    bump_data_generation()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    bump_user_version(instance.pk)
+    bump_data_generation()
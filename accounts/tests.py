@@ -1,16 +1,66 @@
+import datetime
+import decimal
+import gzip
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import uuid
+from unittest import mock
+
 import requests
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.contrib.auth.models import Group, Permission
+from django.db import connection
+from django.db.models import QuerySet
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
+from django.core.cache import cache, caches
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.core.management import call_command
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 
+from accounts import views
+from accounts.admin import EstimatedCountPaginator
+from accounts.audit import AuditBuffer, audit_log, audit_stats
+from accounts.backends import AdmarenAuthBackend, AuthServerError
+from accounts.caching import response_cache_hits
+from accounts.checks import shared_cache_check
+from accounts.filters import UserFilter
+from accounts.management.seed import seed_accounts
+from accounts.management.stub_auth import StubAuthServer
+from accounts.metrics import Histogram, Registry, render_text
+from accounts.middleware import ReplicaRoutingMiddleware, accepted_encodings
+from accounts.models import AuthAuditEvent, RemoteUserOutbox
+from accounts.openapi import schemas
+from accounts.outbox import drain, unseal
+from accounts.parsers import FastJSONParser
+from accounts.reconcile import reconcile_batch
+from accounts.permissions import has_permissions
+from accounts.querybudget import QueryBudgetExceeded, count_queries, sql_shape
+from accounts.readers import GroupReader, PermissionReader, UserReader
+from accounts.renderers import FastJSONRenderer
+from accounts.routers import ReplicaRouter
+from accounts.throttling import LoginUsernameThrottle, UserExistsIPThrottle
+from accounts.versions import data_generation
+from accounts.serializers import (
+    GroupsGetDetailSerializer,
+    PermissionSerializer,
+    UsersListSerializer,
+)
 from utils import random_name
 
 PROFILE_VIEW = "accounts:user_profile"
 CREAT_LIST_USER = reverse("accounts:create_list_user")
 GROUP_LIST = reverse("accounts:group-list")
 GROUP_DETAIL = "accounts:group-detail"
+UPDATE_USER = "accounts:update_user"
 
 
 class BaseTest(TestCase):
@@ -27,6 +77,9 @@ class BaseTest(TestCase):
             first_name="john",
             last_name="wilson",
         )
+        self.auth_server = StubAuthServer().start()
+        self.addCleanup(self.auth_server.stop)
+        self.auth_server.add_user(**self.data)
         self.login_url = reverse("accounts:login_api")
         self.login_res = self.client.post(
             self.login_url,
@@ -196,3 +249,1206 @@ class GroupTest(BaseTest):
             CREAT_LIST_USER, data, HTTP_AUTHORIZATION=self.access_token
         )
         self.assertEquals(response.status_code, status.HTTP_201_CREATED)
+
+
+class SparseFieldsTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.group = Group.objects.create(name=random_name())
+        self.permission = Permission.objects.first()
+        self.group.permissions.add(self.permission)
+        self.user = get_user_model().objects.create(username=random_name())
+        self.user.groups.add(self.group)
+        self.url = reverse(UPDATE_USER, kwargs={"pk": self.user.pk})
+
+    def test_full_payload(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        role = response.data.get("roles")[0]
+        self.assertEqual(role["permissions"][0]["codename"], self.permission.codename)
+
+    def test_fields(self):
+        response = self.client.get(self.url, {"fields": "id,username"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data), {"id", "username"})
+
+    def test_expand_roles_only(self):
+        response = self.client.get(self.url, {"expand": "roles"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        role = response.data.get("roles")[0]
+        self.assertEqual(role["permissions"], [self.permission.pk])
+
+    def test_no_expand(self):
+        response = self.client.get(self.url, {"fields": "id,roles", "expand": ""})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.get("roles"), [self.group.pk])
+
+
+class ExportUsersTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.group = Group.objects.create(name=random_name())
+        self.group.permissions.add(Permission.objects.get(codename="view_user"))
+        self.user = get_user_model().objects.create(username=random_name())
+        self.user.groups.add(self.group)
+        self.client.force_authenticate(self.user)
+        self.url = reverse("accounts:export_users")
+
+    def content(self, response):
+        return b"".join(response.streaming_content).decode()
+
+    def test_export_ndjson(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        row = next(row for row in rows if row["id"] == self.user.pk)
+        self.assertEqual(row["roles"], [self.group.name])
+
+    def test_export_csv(self):
+        response = self.client.get(self.url, {"export_format": "csv"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = self.content(response).splitlines()
+        self.assertEqual(lines[0].split(",")[-1], "roles")
+        self.assertIn(self.user.username, "".join(lines[1:]))
+
+    def test_export_unknown_format(self):
+        response = self.client.get(self.url, {"export_format": "xml"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FastReaderTest(TestCase):
+    def setUp(self) -> None:
+        self.group = Group.objects.create(name=random_name())
+        self.group.permissions.set(Permission.objects.all()[:5])
+        for _ in range(3):
+            user = get_user_model().objects.create(username=random_name())
+            user.groups.add(self.group)
+
+    def assertSameOutput(self, queryset, serializer_class, reader):
+        renderer = JSONRenderer()
+        expected = serializer_class(queryset, many=True).data
+        rows = list(queryset.values_list(*reader.lookups))
+        self.assertEqual(
+            renderer.render(reader.read(rows)), renderer.render(expected)
+        )
+
+    def test_users(self):
+        users = get_user_model().objects.all()
+        self.assertSameOutput(users, UsersListSerializer, UserReader())
+
+    def test_groups(self):
+        self.assertSameOutput(
+            Group.objects.all(), GroupsGetDetailSerializer, GroupReader()
+        )
+
+    def test_permissions(self):
+        self.assertSameOutput(
+            Permission.objects.all(), PermissionSerializer, PermissionReader()
+        )
+
+    def test_sparse_users(self):
+        first, second = [Group.objects.create(name=random_name()) for _ in range(2)]
+        user = get_user_model().objects.create(username=random_name())
+        user.groups.add(second)
+        user.groups.add(first)
+        response = APIClient().get(
+            CREAT_LIST_USER, {"fields": "id,roles", "expand": ""}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        items = response.data["results"]
+        self.assertTrue(items)
+        for item in items:
+            self.assertEqual(set(item), {"id", "roles"})
+            self.assertEqual(item["roles"], sorted(item["roles"]))
+        response = APIClient().get(
+            CREAT_LIST_USER,
+            {"fields": "id,roles", "expand": "", "username": user.username},
+        )
+        (item,) = response.data["results"]
+        self.assertEqual(item, {"id": user.pk, "roles": [first.pk, second.pk]})
+
+    def test_roles_added_out_of_order(self):
+        first, second = [Group.objects.create(name=random_name()) for _ in range(2)]
+        user = get_user_model().objects.create(username=random_name())
+        user.groups.add(second)
+        user.groups.add(first)
+        users = get_user_model().objects.filter(pk=user.pk)
+        self.assertSameOutput(users, UsersListSerializer, UserReader())
+        self.assertSameOutput(
+            users.prefetch_related("groups"), UsersListSerializer, UserReader()
+        )
+        reader = UserReader(fields={"id", "roles"}, expand=set())
+        data = reader.read(list(users.values_list(*reader.lookups)))
+        self.assertEqual(data, [{"id": user.pk, "roles": [first.pk, second.pk]}])
+
+
+class FastJSONTest(TestCase):
+    def test_same_output_as_json_renderer(self):
+        data = {
+            "id": 1,
+            "name": "r\u00f4le \u2028",
+            "timestamp": datetime.datetime(2021, 5, 27, tzinfo=datetime.timezone.utc),
+            "date": datetime.date(2021, 5, 27),
+            "uuid": uuid.uuid4(),
+            "amount": decimal.Decimal("1.5"),
+            "roles": [{"id": 1, "permissions": []}],
+        }
+        self.assertEqual(
+            FastJSONRenderer().render(data), JSONRenderer().render(data)
+        )
+
+    def test_parse(self):
+        data = FastJSONParser().parse(io.BytesIO(b'{"roles": [1, 2]}'))
+        self.assertEqual(data, {"roles": [1, 2]})
+
+
+class PermissionBitsTest(TestCase):
+    def setUp(self) -> None:
+        self.permission = Permission.objects.get(codename="view_user")
+        self.group = Group.objects.create(name=random_name())
+        self.user = get_user_model().objects.create(username=random_name())
+        self.user.groups.add(self.group)
+
+    def fresh_user(self):
+        return get_user_model().objects.get(pk=self.user.pk)
+
+    def test_granted_through_group(self):
+        self.assertFalse(has_permissions(self.fresh_user(), ["accounts.view_user"]))
+        self.group.permissions.add(self.permission)
+        self.assertTrue(has_permissions(self.fresh_user(), ["accounts.view_user"]))
+
+    def test_removed_from_group(self):
+        self.group.permissions.add(self.permission)
+        self.assertTrue(has_permissions(self.fresh_user(), ["accounts.view_user"]))
+        self.user.groups.remove(self.group)
+        self.assertFalse(has_permissions(self.fresh_user(), ["accounts.view_user"]))
+
+    def test_unknown_permission(self):
+        self.assertFalse(has_permissions(self.fresh_user(), ["accounts.unknown"]))
+
+    @override_settings(VERSION_BUMP_ON_COMMIT=True)
+    def test_invalidated_on_commit(self):
+        self.assertFalse(has_permissions(self.fresh_user(), ["accounts.view_user"]))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.permissions.add(self.permission)
+            # readers before the commit may still cache the old bitset
+            self.assertFalse(
+                has_permissions(self.fresh_user(), ["accounts.view_user"])
+            )
+        self.assertTrue(has_permissions(self.fresh_user(), ["accounts.view_user"]))
+
+    def test_export_forbidden_without_permission(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse("accounts:export_users"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class UserFilterTest(TestCase):
+    def setUp(self) -> None:
+        self.group = Group.objects.create(name=random_name())
+        self.user = get_user_model().objects.create(
+            username="filter-john", email="john@filter.com", first_name="John"
+        )
+        self.user.groups.add(self.group)
+        get_user_model().objects.create(
+            username="filter-jane", email="jane@filter.com", is_active=False
+        )
+
+    def filter(self, **params):
+        queryset = get_user_model().objects.filter(username__startswith="filter-")
+        return list(UserFilter(params, queryset=queryset).qs)
+
+    def test_prefix(self):
+        self.assertEqual(self.filter(username="FILTER-JO"), [self.user])
+        self.assertEqual(self.filter(first_name="jo"), [self.user])
+
+    def test_search(self):
+        self.assertEqual(self.filter(search="john@"), [self.user])
+
+    def test_is_active_and_role(self):
+        self.assertEqual(self.filter(is_active="true"), [self.user])
+        self.assertEqual(self.filter(role=self.group.pk), [self.user])
+        self.assertEqual(self.filter(role_name=self.group.name), [self.user])
+
+
+class QueryPlanTest(TestCase):
+    """
+    EXPLAIN every query of the accounts endpoints on a seeded dataset and fail
+    on full scans of the large tables.
+
+    Postgres runs with ``enable_seqscan = off`` so a sequential scan in the
+    plan means no index can serve the query. Set ``QUERY_PLANS_OUTPUT`` to a
+    file path to record the plans.
+    """
+
+    LARGE_TABLES = [
+        "accounts_user",
+        "accounts_user_groups",
+        "auth_group_permissions",
+    ]
+    SQLITE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?!.*USING)")
+    POSTGRES_SCAN = re.compile(r"Seq Scan on (\w+)")
+    plans = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        users, groups = seed_accounts(
+            int(os.environ.get("QUERY_PLAN_USERS", 2000)), 20, prefix="plan"
+        )
+        cls.user = users[0]
+        cls.group = groups[0]
+        cls.superuser = get_user_model().objects.create(
+            username=random_name(), is_superuser=True
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    @classmethod
+    def tearDownClass(cls):
+        output = os.environ.get("QUERY_PLANS_OUTPUT")
+        if output:
+            with open(output, "w") as plans_file:
+                json.dump(cls.plans, plans_file, indent=2)
+        super(QueryPlanTest, cls).tearDownClass()
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.client.force_authenticate(self.superuser)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute(f"EXPLAIN {sql}")
+                return [row[0] for row in cursor.fetchall()]
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return [row[-1] for row in cursor.fetchall()]
+
+    def full_scans(self, plan, full_reads=()):
+        pattern = self.POSTGRES_SCAN
+        if connection.vendor == "sqlite":
+            pattern = self.SQLITE_SCAN
+        scans = []
+        for line in plan:
+            match = pattern.search(line.strip())
+            table = match and match.group(1)
+            if table in self.LARGE_TABLES and table not in full_reads:
+                scans.append(line.strip())
+        return scans
+
+    def assertIndexedPlans(self, name, url, params=None, full_reads=()):
+        """
+        ``full_reads`` are the tables the endpoint reads in full on purpose
+        """
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params or {})
+            if response.streaming:
+                b"".join(response.streaming_content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        queries = [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].lstrip().upper().startswith("SELECT")
+        ]
+        self.plans[name] = []
+        for sql in queries:
+            plan = self.explain(sql)
+            self.plans[name].append({"sql": sql, "plan": plan})
+            message = f"{name}: full scan in\n{sql}\n" + "\n".join(plan)
+            self.assertFalse(self.full_scans(plan, full_reads), message)
+
+    def test_users_list(self):
+        self.assertIndexedPlans("users", CREAT_LIST_USER)
+
+    def test_users_filters(self):
+        filters = {
+            "users_username": {"username": "plan-user-1"},
+            "users_email": {"email": "plan-user-1"},
+            "users_role": {"role": self.group.pk},
+        }
+        if connection.vendor == "postgresql":
+            # substring search has no index on sqlite
+            filters["users_search"] = {"search": "user-12"}
+        for name, params in filters.items():
+            self.assertIndexedPlans(name, CREAT_LIST_USER, params)
+
+    def test_user_detail(self):
+        url = reverse(UPDATE_USER, kwargs={"pk": self.user.pk})
+        self.assertIndexedPlans("user_detail", url)
+
+    def test_profile(self):
+        self.assertIndexedPlans("profile", reverse(PROFILE_VIEW))
+
+    def test_roles_list(self):
+        self.assertIndexedPlans("roles", GROUP_LIST)
+
+    def test_permissions_list(self):
+        self.assertIndexedPlans("permissions", reverse("accounts:permissions"))
+
+    def test_export(self):
+        # the export reads every user in pk order, sqlite plans that as a
+        # rowid scan, the role lookups per chunk still need their index
+        self.assertIndexedPlans(
+            "export", reverse("accounts:export_users"), full_reads=["accounts_user"]
+        )
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class ReplicaRoutingTest(SimpleTestCase):
+    def setUp(self) -> None:
+        self.factory = RequestFactory()
+        self.middleware = ReplicaRoutingMiddleware(self.handler)
+        self.view = views.CreateListUserApiView.as_view()
+
+    def handler(self, request):
+        # stands in for django's handler running process_view and the view
+        self.middleware.process_view(request, self.view, (), {})
+        response = HttpResponse()
+        response.db = ReplicaRouter().db_for_read(get_user_model())
+        return response
+
+    def test_read_goes_to_replica(self):
+        response = self.middleware(self.factory.get(CREAT_LIST_USER))
+        self.assertEqual(response.db, "replica")
+        self.assertEqual(ReplicaRouter().db_for_read(get_user_model()), "default")
+
+    def test_write_pins_primary(self):
+        response = self.middleware(self.factory.post(CREAT_LIST_USER))
+        self.assertEqual(response.db, "default")
+        cookie = response.cookies[ReplicaRoutingMiddleware.cookie_name]
+        request = self.factory.get(CREAT_LIST_USER)
+        request.COOKIES[cookie.key] = cookie.value
+        self.assertEqual(self.middleware(request).db, "default")
+
+    def test_header_pins_primary(self):
+        request = self.factory.get(CREAT_LIST_USER, HTTP_X_READ_PRIMARY="1")
+        self.assertEqual(self.middleware(request).db, "default")
+
+
+class RemoteUserOutboxTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.data = dict(username=random_name(), password="asd123####")  # NOSONAR
+        self.remote = mock.patch(
+            "accounts.outbox.auth_handler.backend.create_remote_user"
+        )
+
+    def create_user(self):
+        with mock.patch("accounts.auth_state.auth_handler.create_remote_user") as call:
+            response = self.client.post(CREAT_LIST_USER, data=self.data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        call.assert_not_called()
+        return RemoteUserOutbox.objects.get(user__username=self.data["username"])
+
+    def test_create_writes_outbox(self):
+        entry = self.create_user()
+        self.assertEqual(entry.status, RemoteUserOutbox.PENDING)
+        self.assertEqual(entry.payload["username"], self.data["username"])
+
+    def test_password_encrypted(self):
+        entry = self.create_user()
+        self.assertNotIn("password", entry.payload)
+        self.assertNotIn(self.data["password"], entry.secrets)
+        self.assertEqual(unseal(entry.secrets)["password"], self.data["password"])
+        with self.remote as create_remote_user:
+            self.assertEqual(drain(), (1, 0))
+        data = create_remote_user.call_args[1]["data"]
+        self.assertEqual(data["password"], self.data["password"])
+
+    def test_drain_sent(self):
+        entry = self.create_user()
+        with self.remote as create_remote_user:
+            self.assertEqual(drain(), (1, 0))
+        create_remote_user.assert_called_once()
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, RemoteUserOutbox.SENT)
+        self.assertEqual(entry.payload, {})
+
+    def test_drain_retry_and_status(self):
+        entry = self.create_user()
+        with self.remote as create_remote_user:
+            create_remote_user.side_effect = Exception("Authorization Server Error")
+            self.assertEqual(drain(max_attempts=2), (0, 1))
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, RemoteUserOutbox.PENDING)
+        self.assertEqual(entry.attempts, 1)
+        self.client.force_authenticate(entry.user)
+        url = reverse("accounts:remote_user_status", kwargs={"pk": entry.user_id})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["last_error"], "Authorization Server Error")
+
+    def test_status_of_other_user_hidden(self):
+        entry = self.create_user()
+        self.client.force_authenticate(
+            get_user_model().objects.create(username=random_name())
+        )
+        url = reverse("accounts:remote_user_status", kwargs={"pk": entry.user_id})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_failed_drops_payload(self):
+        entry = self.create_user()
+        with self.remote as create_remote_user:
+            create_remote_user.side_effect = Exception("Authorization Server Error")
+            self.assertEqual(drain(max_attempts=1), (0, 1))
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, RemoteUserOutbox.FAILED)
+        self.assertEqual((entry.payload, entry.secrets), ({}, ""))
+
+    def test_retries_send_same_key(self):
+        entry = self.create_user()
+        with self.remote as create_remote_user:
+            create_remote_user.side_effect = Exception("Authorization Server Error")
+            drain()
+            RemoteUserOutbox.objects.update(next_attempt_at=timezone.now())
+            drain()
+        calls = create_remote_user.call_args_list
+        keys = {call[1]["idempotency_key"] for call in calls}
+        self.assertEqual(keys, {f"accounts-outbox-{entry.pk}"})
+
+    def test_already_exists_marked_sent(self):
+        entry = self.create_user()
+        error = AuthServerError(400, '{"username": ["already exists"]}')
+        with self.remote as create_remote_user:
+            create_remote_user.side_effect = error
+            self.assertEqual(drain(), (1, 0))
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, RemoteUserOutbox.SENT)
+
+    @override_settings(AUTH_SERVICE_USERNAME="outbox-service")
+    def test_drain_with_service_account(self):
+        entry = self.create_user()
+        self.assertNotIn("access_token", unseal(entry.secrets))
+        service_token = mock.patch(
+            "accounts.outbox.auth_handler.service_access_token",
+            return_value="service-token",
+        )
+        with self.remote as create_remote_user, service_token:
+            self.assertEqual(drain(), (1, 0))
+        self.assertEqual(create_remote_user.call_args[0][0], "service-token")
+
+
+class ProfileSyncTest(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = get_user_model().objects.create(
+            username=random_name(), first_name="john", email="john@admaren.com"
+        )
+        self.profile = dict(
+            username=self.user.username,
+            first_name="john",
+            last_name="",
+            email="john@admaren.com",
+            is_active=True,
+        )
+
+    def test_unchanged_profile_not_written(self):
+        self.assertFalse(AdmarenAuthBackend.sync_user(self.user.username, self.profile))
+        with self.assertNumQueries(0):
+            AdmarenAuthBackend.sync_user(self.user.username, self.profile)
+
+    def test_changed_fields_written(self):
+        self.profile["first_name"] = "johnny"
+        self.assertTrue(AdmarenAuthBackend.sync_user(self.user.username, self.profile))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "johnny")
+        with self.assertNumQueries(0):
+            AdmarenAuthBackend.sync_user(self.user.username, self.profile)
+
+    def test_local_edit_overwritten(self):
+        AdmarenAuthBackend.sync_user(self.user.username, self.profile)
+        self.user.first_name = "local"
+        self.user.save()
+        self.assertTrue(AdmarenAuthBackend.sync_user(self.user.username, self.profile))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "john")
+
+    def test_concurrent_profile_not_applied(self):
+        first = QuerySet.first
+
+        def first_then_race(queryset):
+            # another login applies its profile between the read and the write
+            user = first(queryset)
+            get_user_model().objects.filter(pk=user.pk).update(profile_hash="other")
+            return user
+
+        self.profile["first_name"] = "johnny"
+        with mock.patch.object(QuerySet, "first", first_then_race):
+            synced = AdmarenAuthBackend.sync_user(self.user.username, self.profile)
+        self.assertFalse(synced)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "john")
+
+
+class ReconcileTest(TestCase):
+    def setUp(self) -> None:
+        self.group = Group.objects.create(name=random_name())
+        self.user = get_user_model().objects.create(
+            username=random_name(), first_name="john"
+        )
+
+    def test_reconcile_batch(self):
+        remote = [
+            dict(
+                username=self.user.username,
+                first_name="johnny",
+                is_active=False,
+                roles=[self.group.name],
+            ),
+            dict(username="unknown user", first_name="jane"),
+        ]
+        fields = AdmarenAuthBackend.user_fields
+        self.assertEqual(reconcile_batch(remote, fields), (1, 1))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "johnny")
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(list(self.user.groups.all()), [self.group])
+        self.assertEqual(reconcile_batch(remote, fields), (0, 0))
+
+    def test_command_stops_on_repeated_pages(self):
+        remote = [dict(username=self.user.username, first_name="johnny")]
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, "checkpoint.json")
+            with mock.patch(
+                "accounts.auth_state.backend_cls.list_remote_users",
+                return_value=remote,
+            ) as list_remote_users:
+                call_command(
+                    "reconcile_users",
+                    access_token="token",
+                    checkpoint=checkpoint,
+                    workers=1,
+                    stdout=io.StringIO(),
+                )
+            self.assertFalse(os.path.exists(checkpoint))
+        self.assertEqual(list_remote_users.call_count, 2)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, "johnny")
+
+
+class RateLimitTest(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.url = reverse("accounts:users_exists")
+
+    @mock.patch.object(
+        UserExistsIPThrottle, "THROTTLE_RATES", {"users_exists_ip": "2/min"}
+    )
+    def test_users_exists_limited(self):
+        for _ in range(2):
+            response = self.client.post(self.url, data={"username": "unknown user"})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(self.url, data={"username": "unknown user"})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+
+    @mock.patch.object(
+        UserExistsIPThrottle, "THROTTLE_RATES", {"users_exists_ip": "2/min"}
+    )
+    def test_forwarded_for_ignored(self):
+        for index in range(2):
+            response = self.client.post(
+                self.url,
+                data={"username": "unknown user"},
+                HTTP_X_FORWARDED_FOR=f"10.0.0.{index}",
+            )
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(
+            self.url, data={"username": "unknown user"}, HTTP_X_FORWARDED_FOR="10.0.1.1"
+        )
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_username_key_of_list_body(self):
+        throttle = LoginUsernameThrottle()
+        self.assertIsNone(throttle.get_cache_key(mock.Mock(data=["john"]), None))
+
+    def test_username_key_is_hashed(self):
+        throttle = LoginUsernameThrottle()
+        key = throttle.get_cache_key(mock.Mock(data={"username": " John Doe\n"}), None)
+        self.assertRegex(key, r"^[0-9a-f]{32}$")
+        other = throttle.get_cache_key(mock.Mock(data={"username": "john doe"}), None)
+        self.assertEqual(key, other)
+
+
+class BulkRoleAssignmentTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.client.force_authenticate(
+            get_user_model().objects.create(username=random_name(), is_superuser=True)
+        )
+        self.roles = [Group.objects.create(name=random_name()) for _ in range(2)]
+        self.users = [
+            get_user_model().objects.create(username=random_name()) for _ in range(3)
+        ]
+        self.permission = Permission.objects.get(codename="view_user")
+        self.url = reverse("accounts:group-bulk-assign")
+
+    def test_add_and_remove(self):
+        self.users[0].groups.add(self.roles[0])
+        data = dict(
+            roles=[role.pk for role in self.roles],
+            add_users=[user.pk for user in self.users[1:]],
+            remove_users=[self.users[0].pk],
+            add_permissions=[self.permission.pk],
+        )
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["users_added"], 4)
+        self.assertEqual(response.data["users_removed"], 1)
+        self.assertEqual(response.data["permissions_added"], 2)
+        self.assertEqual(self.roles[1].user_set.count(), 2)
+        self.assertTrue(has_permissions(self.users[1], ["accounts.view_user"]))
+
+    def test_invalid_pk(self):
+        data = dict(roles=[self.roles[0].pk], add_users=[0])
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("add_users", response.data)
+
+
+class ProfileETagTest(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = get_user_model().objects.create(username=random_name())
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse(PROFILE_VIEW)
+
+    def etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response["ETag"]
+
+    def test_not_modified(self):
+        etag = self.etag()
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_changes_bump_etag(self):
+        etag = self.etag()
+        self.user.last_name = random_name()
+        self.user.save()
+        self.assertNotEqual(self.etag(), etag)
+        etag = self.etag()
+        group = Group.objects.create(name=random_name())
+        self.user.groups.add(group)
+        self.assertNotEqual(self.etag(), etag)
+        etag = self.etag()
+        group.permissions.add(Permission.objects.first())
+        self.assertNotEqual(self.etag(), etag)
+
+    def test_row_change_without_version_bump(self):
+        # another worker with its own cache saved the user
+        etag = self.etag()
+        users = get_user_model().objects.filter(pk=self.user.pk)
+        users.update(last_updated=timezone.now())
+        self.user.refresh_from_db()
+        self.assertNotEqual(self.etag(), etag)
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        caches["responses"].clear()
+        response_cache_hits.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(
+            get_user_model().objects.create(username=random_name(), is_superuser=True)
+        )
+
+    def test_hit_until_write(self):
+        response = self.client.get(CREAT_LIST_USER, {"page": 1, "ordering": "id"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            cached = self.client.get(CREAT_LIST_USER, {"ordering": "id", "page": 1})
+        self.assertEqual(cached.data, response.data)
+        get_user_model().objects.create(username=random_name())
+        response = self.client.get(CREAT_LIST_USER, {"page": 1, "ordering": "id"})
+        self.assertEqual(response.data["count"], cached.data["count"] + 1)
+        self.assertEqual(response_cache_hits[("users", "hit")], 1)
+        self.assertEqual(response_cache_hits[("users", "miss")], 2)
+
+    @override_settings(VERSION_BUMP_ON_COMMIT=True)
+    def test_invalidated_on_commit(self):
+        params = {"page": 1, "ordering": "id"}
+        count = self.client.get(CREAT_LIST_USER, params).data["count"]
+        with self.captureOnCommitCallbacks(execute=True):
+            get_user_model().objects.create(username=random_name())
+            # the generation, and its cached page, stay until the commit
+            self.assertEqual(
+                self.client.get(CREAT_LIST_USER, params).data["count"], count
+            )
+        response = self.client.get(CREAT_LIST_USER, params)
+        self.assertEqual(response.data["count"], count + 1)
+
+    def test_role_change_invalidates(self):
+        group = Group.objects.create(name=random_name())
+        self.client.get(GROUP_LIST)
+        group.permissions.add(Permission.objects.first())
+        response = self.client.get(GROUP_LIST)
+        self.assertEqual(response_cache_hits[("roles", "miss")], 2)
+        stats = self.client.get(reverse("accounts:response_cache")).data
+        self.assertEqual(stats["roles"]["hit_ratio"], 0)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class BatchTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.client.force_authenticate(
+            get_user_model().objects.create(username=random_name(), is_superuser=True)
+        )
+        self.url = reverse("accounts:batch")
+
+    def test_batch(self):
+        name = random_name()
+        data = dict(
+            requests=[
+                dict(path=reverse(PROFILE_VIEW)),
+                dict(method="POST", path=GROUP_LIST, body=dict(name=name)),
+                dict(path=GROUP_LIST),
+                dict(path="/api/v1/unknown/"),
+                dict(method="POST", path=self.url, body=dict(requests=[])),
+            ]
+        )
+        response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile, created, roles, unknown, nested = response.data["responses"]
+        self.assertEqual(profile["status"], status.HTTP_200_OK)
+        self.assertIn("ETag", profile["headers"])
+        self.assertEqual(created["status"], status.HTTP_201_CREATED)
+        self.assertEqual(roles["status"], status.HTTP_200_OK)
+        self.assertIn(name, json.dumps(roles["body"]))
+        self.assertEqual(unknown["status"], status.HTTP_404_NOT_FOUND)
+        self.assertEqual(nested["status"], status.HTTP_400_BAD_REQUEST)
+
+    def test_failing_item_isolated(self):
+        data = dict(requests=[dict(path=GROUP_LIST), dict(path=reverse(PROFILE_VIEW))])
+        with mock.patch.object(
+            views.GroupsAPiView, "list", side_effect=RuntimeError("boom")
+        ), self.assertLogs("accounts.batch", "ERROR"):
+            response = self.client.post(self.url, data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        roles, profile = response.data["responses"]
+        self.assertEqual(roles["status"], status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(profile["status"], status.HTTP_200_OK)
+
+    def test_requires_items(self):
+        response = self.client.post(self.url, dict(requests=[]), format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BatchCreateUserTest(BaseTest):
+    def test_outbox_keeps_access_token(self):
+        username = random_name()
+        item = dict(
+            method="POST",
+            path=CREAT_LIST_USER,
+            body=dict(username=username, password="asd123####"),  # NOSONAR
+        )
+        response = self.client.post(
+            reverse("accounts:batch"),
+            dict(requests=[item]),
+            format="json",
+            HTTP_AUTHORIZATION=self.access_token,
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        created = response.data["responses"][0]
+        self.assertEqual(created["status"], status.HTTP_201_CREATED)
+        entry = RemoteUserOutbox.objects.get(user__username=username)
+        access_token = unseal(entry.secrets)["access_token"]
+        self.assertEqual(access_token, self.login_res.data["access"])
+
+
+class AuditLogTest(TestCase):
+    def setUp(self) -> None:
+        audit_log.flush()
+        audit_stats.clear()
+        self.user = get_user_model().objects.create(
+            username=random_name(), is_superuser=True
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_buffer_drops_when_full(self):
+        buffer = AuditBuffer(capacity=2, flush_size=2, flush_interval=1, threaded=False)
+        for _ in range(3):
+            buffer.record(AuthAuditEvent.LOGIN, self.user.username)
+        self.assertEqual(audit_stats["dropped"], 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(AuthAuditEvent.objects.count(), 2)
+
+    def test_flush_error_counted(self):
+        buffer = AuditBuffer(capacity=2, flush_size=1, flush_interval=1, threaded=False)
+        buffer.record(AuthAuditEvent.LOGIN, self.user.username)
+        with mock.patch.object(
+            AuthAuditEvent.objects, "bulk_create", side_effect=ValueError("bad row")
+        ), self.assertLogs("accounts.audit", "ERROR"):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(audit_stats["failed"], 1)
+
+    def test_role_changes_are_audited(self):
+        response = self.client.post(GROUP_LIST, dict(name=random_name()))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        role = response.data["id"]
+        self.assertEqual(AuthAuditEvent.objects.count(), 0)
+        audit_log.flush()
+        url = reverse("accounts:audit_events")
+        response = self.client.get(url, dict(event=AuthAuditEvent.ROLE_CREATED))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        (event,) = response.data["results"]
+        self.assertEqual(event["actor_id"], self.user.pk)
+        self.assertEqual(event["detail"]["role"], role)
+
+    def test_user_roles_update_is_audited(self):
+        role = Group.objects.create(name=random_name())
+        user = get_user_model().objects.create(username=random_name())
+        url = reverse("accounts:update_user", kwargs={"pk": user.pk})
+        response = self.client.patch(url, dict(roles=[role.pk]), format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        audit_log.flush()
+        event = AuthAuditEvent.objects.get(event=AuthAuditEvent.ROLES_ASSIGNED)
+        self.assertEqual(event.username, user.username)
+        self.assertEqual(event.detail, {"added": [role.pk], "removed": []})
+
+
+class UserAdminTest(TestCase):
+    def setUp(self) -> None:
+        self.user = get_user_model().objects.create(
+            username=random_name(), is_superuser=True, is_staff=True
+        )
+        self.client.force_login(self.user)
+
+    def test_bounded_count(self):
+        seed_accounts(5, 1, prefix=random_name())
+        queryset = get_user_model().objects.order_by("pk")
+        with override_settings(ADMIN_EXACT_COUNT_THRESHOLD=3):
+            # sqlite has no estimate, the exact count is the fallback
+            self.assertEqual(EstimatedCountPaginator(queryset, 2).count, 6)
+        with self.assertNumQueries(1):
+            self.assertEqual(EstimatedCountPaginator(queryset, 2).count, 6)
+
+    def test_changelist(self):
+        seed_accounts(20, 2, prefix=random_name())
+        url = reverse("admin:accounts_user_changelist")
+        response = self.client.get(url, {"q": self.user.username})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, self.user.username)
+
+
+class CompressionTest(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = get_user_model().objects.create(username=random_name())
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_accepted_encodings(self):
+        self.assertEqual(
+            accepted_encodings("gzip;q=0.5, br, identity;q=0"), ["br", "gzip"]
+        )
+
+    @override_settings(COMPRESSION_MIN_SIZE=0)
+    def test_gzip_keeps_weak_etag(self):
+        url = reverse(PROFILE_VIEW)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertTrue(response["ETag"].startswith("W/"))
+        data = json.loads(gzip.decompress(response.content))
+        self.assertEqual(data["username"], self.user.username)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(COMPRESSION_MIN_SIZE=0)
+    def test_views_opt_in(self):
+        url = reverse("accounts:users_exists")
+        response = self.client.post(
+            url, {"username": random_name()}, HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertFalse(response.has_header("Content-Encoding"))
+        response = self.client.get(
+            reverse("accounts:permissions"), HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+
+    def test_small_bodies_are_not_compressed(self):
+        response = self.client.get(reverse(PROFILE_VIEW), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+
+class IdempotencyTest(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(
+            get_user_model().objects.create(username=random_name())
+        )
+        self.data = dict(username=random_name(), password="asd123####")  # NOSONAR
+        self.key = str(uuid.uuid4())
+
+    def post(self, data):
+        return self.client.post(
+            CREAT_LIST_USER, data=data, HTTP_IDEMPOTENCY_KEY=self.key
+        )
+
+    def test_retry_is_replayed(self):
+        response = self.post(self.data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        retry = self.post(self.data)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.data, response.data)
+        users = get_user_model().objects.filter(username=self.data["username"])
+        self.assertEqual(users.count(), 1)
+        self.assertEqual(RemoteUserOutbox.objects.filter(user__in=users).count(), 1)
+
+    def test_key_reused_with_other_body(self):
+        self.post(self.data)
+        response = self.post(dict(self.data, username=random_name()))
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_anonymous_keys_scoped_by_request(self):
+        self.client.force_authenticate(None)
+        response = self.post(self.data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        other = self.post(dict(self.data, username=random_name()))
+        self.assertEqual(other.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(other.has_header("Idempotent-Replayed"))
+        self.assertNotEqual(other.data, response.data)
+        self.assertEqual(self.post(self.data)["Idempotent-Replayed"], "true")
+
+    def test_in_flight_original(self):
+        with override_settings(IDEMPOTENCY_WAIT=0):
+            with mock.patch("accounts.idempotency.cache.add", return_value=False):
+                response = self.post(self.data)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+
+class StubAuthServerTest(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.auth_server = StubAuthServer(seed=0).start()
+        self.addCleanup(self.auth_server.stop)
+        self.auth_server.add_user("stub-user", "asd123####")  # NOSONAR
+        self.login_url = reverse("accounts:login_api")
+
+    def test_failure_injection(self):
+        self.auth_server.failure_rate = 1
+        data = dict(username="stub-user", password="asd123####")  # NOSONAR
+        response = self.client.post(self.login_url, data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.auth_server.calls["failed"], 1)
+
+    def test_benchmark_endpoints(self):
+        generation = data_generation()
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            call_command(
+                "benchmark_endpoints",
+                users=5,
+                roles=1,
+                requests=2,
+                warmup=0,
+                only=["user_profile", "group-list"],
+                output=output.name,
+                stdout=io.StringIO(),
+                stderr=io.StringIO(),
+            )
+            report = json.load(output)
+        self.assertEqual(set(report["endpoints"]), {"user_profile", "group-list"})
+        profile = report["endpoints"]["user_profile"]
+        self.assertEqual(profile["statuses"], {"200": 2})
+        self.assertLessEqual(profile["p50_ms"], profile["p99_ms"])
+        # nothing cached from the rolled back rows is served again
+        self.assertNotEqual(data_generation(), generation)
+
+    def test_benchmark_leaves_no_audit_events(self):
+        audit_log.flush()
+        events = AuthAuditEvent.objects.count()
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            call_command(
+                "benchmark_endpoints",
+                users=5,
+                roles=1,
+                requests=1,
+                warmup=0,
+                only=["group-bulk-assign"],
+                output=output.name,
+                stdout=io.StringIO(),
+                stderr=io.StringIO(),
+            )
+        self.assertEqual(audit_log.flush(), 0)
+        self.assertEqual(AuthAuditEvent.objects.count(), events)
+
+
+class QueryBudgetTest(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(
+            get_user_model().objects.create(username=random_name(), is_superuser=True)
+        )
+
+    def count(self, url, **params):
+        caches["responses"].clear()
+        with count_queries() as counter:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return counter.count
+
+    def test_sql_shape(self):
+        self.assertEqual(
+            sql_shape('SELECT "id" FROM "t" WHERE "id" IN (%s, %s) AND "n" = 3'),
+            'SELECT "id" FROM "t" WHERE "id" IN (...) AND "n" = ?',
+        )
+
+    def test_constant_in_page_size(self):
+        seed_accounts(5, 2, prefix=random_name())
+        for url in (CREAT_LIST_USER, GROUP_LIST):
+            for params in ({}, {"expand": "roles,roles.permissions,permissions"}):
+                small = self.count(url, **params)
+                seed_accounts(50, 2, prefix=random_name())
+                self.assertEqual(self.count(url, **params), small)
+
+    def test_exceeded(self):
+        with mock.patch.object(views.PermissionApiView, "query_budget", {"GET": 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse("accounts:permissions"))
+
+
+class ServerTimingTest(TestCase):
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.client.force_authenticate(
+            get_user_model().objects.create(username=random_name())
+        )
+
+    @override_settings(SERVER_TIMING=True)
+    def test_header_and_log(self):
+        with self.assertLogs("accounts.timing", "INFO") as logs:
+            response = self.client.get(reverse(PROFILE_VIEW))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        metrics = [part.split(";")[0] for part in response["Server-Timing"].split(", ")]
+        self.assertIn("db", metrics)
+        self.assertIn("render", metrics)
+        self.assertEqual(metrics[-1], "total")
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line["status"], status.HTTP_200_OK)
+        self.assertGreater(line["timings"]["db"]["count"], 0)
+
+    def test_disabled(self):
+        response = self.client.get(reverse(PROFILE_VIEW))
+        self.assertFalse(response.has_header("Server-Timing"))
+
+
+class MetricsTest(TestCase):
+    def test_histogram_thread_shards(self):
+        histogram = Histogram("latency", "test latency", buckets=(0.1, 1))
+
+        def observe():
+            for value in (0.05, 0.5, 5):
+                histogram.observe(value, view="users")
+
+        threads = [threading.Thread(target=observe) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # the shards of finished threads are folded into one total
+        self.assertEqual(histogram.shards, {})
+        ((key, value),) = histogram.collect().items()
+        self.assertEqual(value[:-1], [4, 4, 4])
+        family = dict(kind="histogram", help="", buckets=[0.1, 1], samples={key: value})
+        text = render_text({"latency": family})
+        self.assertIn('latency_bucket{view="users",le="1"} 8', text)
+        self.assertIn('latency_count{view="users"} 12', text)
+
+    def test_aggregate_workers(self):
+        registry = Registry()
+        requests_total = registry.counter("requests_total", "requests")
+        in_flight = registry.gauge("in_flight", "in flight")
+        requests_total.inc(2)
+        in_flight.inc()
+        worker = {
+            "requests_total": dict(kind="counter", help="", samples=[[[], 3]]),
+            "in_flight": dict(kind="gauge", help="", samples=[[[], 5]]),
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            # no process runs with a pid above pid_max
+            path = os.path.join(directory, "4194305.json")
+            with open(path, "w") as fp:
+                json.dump(worker, fp)
+            with override_settings(METRICS_DIR=directory):
+                families = registry.aggregate()
+                # the exited worker was folded into the retired totals
+                self.assertFalse(os.path.exists(path))
+                self.assertEqual(registry.aggregate(), families)
+        self.assertEqual(families["requests_total"]["samples"][()], 5)
+        self.assertEqual(families["in_flight"]["samples"][()], 1)
+
+    def test_retire_at_exit(self):
+        registry = Registry()
+        registry.counter("requests_total", "requests").inc(2)
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(METRICS_DIR=directory):
+                registry.write_snapshot()
+                registry.retire()
+                self.assertFalse(os.path.exists(registry.snapshot_path()))
+                families = Registry().aggregate()
+        self.assertEqual(families["requests_total"]["samples"][()], 2)
+
+    def test_endpoint(self):
+        self.client.get(reverse("accounts:users_exists"))
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        with override_settings(METRICS_TOKEN="secret"):
+            response = self.client.get(
+                reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b"# TYPE accounts_request_seconds histogram", response.content)
+        with override_settings(METRICS_PUBLIC=True):
+            response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class OpenAPISchemaTest(TestCase):
+    url = reverse("schema-json", kwargs={"format": ".json"})
+
+    def test_build_and_serve(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(OPENAPI_SCHEMA_DIR=directory):
+                call_command("build_openapi_schema", stdout=io.StringIO())
+                response = self.client.get(self.url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertIn(CREAT_LIST_USER, json.loads(response.content)["paths"])
+                response = self.client.get(
+                    self.url, HTTP_IF_NONE_MATCH=response["ETag"]
+                )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_serves_prebuilt_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "openapi.json"), "wb") as fp:
+                fp.write(b'{"swagger": "2.0", "paths": {}}')
+            with override_settings(OPENAPI_SCHEMA_DIR=directory):
+                with mock.patch("accounts.openapi.generate_schema") as generate:
+                    response = self.client.get(self.url)
+        generate.assert_not_called()
+        self.assertEqual(response.content, b'{"swagger": "2.0", "paths": {}}')
+        self.assertEqual(response["ETag"], schemas.etag(response.content))
+
+
+class SharedCacheCheckTest(SimpleTestCase):
+    def test_local_cache_rejected_without_debug(self):
+        with override_settings(DEBUG=False):
+            errors = shared_cache_check(None)
+        self.assertEqual([error.id for error in errors], ["accounts.E001"])
+        with override_settings(DEBUG=True):
+            self.assertEqual(shared_cache_check(None), [])
@@ -0,0 +1,101 @@
+import hashlib
+import math
+from collections import Counter
+
+from django.core.cache import cache
+from rest_framework.throttling import SimpleRateThrottle
+
+# ("scope", "allowed" | "rejected") -> count, per process
+throttle_hits = Counter()
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """
+    sliding window rate limit kept in the Django cache
+
+    The count of the previous fixed window is weighted by the part of it the
+    sliding window still covers, so each ident needs two small keys whatever
+    the rate.
+    """
+
+    cache = cache
+    cache_format = "throttle:%(scope)s:%(ident)s:%(window)s"
+
+    def window_key(self, window):
+        return self.cache_format % {
+            "scope": self.scope,
+            "ident": self.key,
+            "window": window,
+        }
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        current_key = self.window_key(window)
+        previous_key = self.window_key(window - 1)
+        counts = self.cache.get_many([current_key, previous_key])
+        self.current = counts.get(current_key, 0)
+        self.previous = counts.get(previous_key, 0)
+        elapsed = (self.now % self.duration) / self.duration
+        if self.previous * (1 - elapsed) + self.current >= self.num_requests:
+            throttle_hits[(self.scope, "rejected")] += 1
+            return False
+        if not self.cache.add(current_key, 1, self.duration * 2):
+            try:
+                self.cache.incr(current_key)
+            except ValueError:
+                self.cache.set(current_key, 1, self.duration * 2)
+        throttle_hits[(self.scope, "allowed")] += 1
+        return True
+
+    def wait(self):
+        """
+        seconds until the weighted count drops below the rate
+        """
+        elapsed = self.now % self.duration
+        if self.current < self.num_requests and self.previous:
+            # the previous window has to slide out far enough
+            fraction = 1 - (self.num_requests - self.current) / self.previous
+            wait = fraction * self.duration - elapsed
+        else:
+            # the current window becomes the previous one first
+            fraction = max(0, 1 - self.num_requests / max(self.current, 1))
+            wait = self.duration - elapsed + fraction * self.duration
+        return max(1, math.ceil(wait))
+
+
+class ClientIPThrottle(SlidingWindowThrottle):
+    def get_cache_key(self, request, view):
+        return self.get_ident(request)
+
+
+class UsernameThrottle(SlidingWindowThrottle):
+    def get_cache_key(self, request, view):
+        if not isinstance(request.data, dict):
+            return None
+        username = request.data.get("username")
+        if not username:
+            return None
+        # usernames may hold characters memcached rejects in keys
+        return hashlib.md5(str(username).strip().lower().encode()).hexdigest()
+
+
+class LoginIPThrottle(ClientIPThrottle):
+    scope = "login_ip"
+
+
+class LoginUsernameThrottle(UsernameThrottle):
+    scope = "login_username"
+
+
+class RefreshIPThrottle(ClientIPThrottle):
+    scope = "refresh_ip"
+
+
+class UserExistsIPThrottle(ClientIPThrottle):
+    scope = "users_exists_ip"
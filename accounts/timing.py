@@ -0,0 +1,73 @@
+import threading
+import time
+from contextvars import ContextVar
+
+# timings of the current request, None outside ServerTimingMiddleware
+request_timings = ContextVar("request_timings", default=None)
+
+
+class Timings(object):
+    """
+    total duration and count per metric name of one request
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self.lock:
+            total, count = self.metrics.get(name, (0.0, 0))
+            self.metrics[name] = (total + seconds, count + 1)
+
+    def header(self, total):
+        parts = [
+            f'{name};dur={seconds * 1000:.1f};desc="n={count}"'
+            for name, (seconds, count) in self.metrics.items()
+        ]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+    def as_dict(self):
+        return {
+            name: {"ms": round(seconds * 1000, 3), "count": count}
+            for name, (seconds, count) in self.metrics.items()
+        }
+
+
+class timed(object):
+    """
+    add the duration of the block to the request timings as ``name``, a
+    single context lookup when timing is off
+    """
+
+    __slots__ = ("name", "timings", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = request_timings.get()
+        if self.timings is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings.add(self.name, time.perf_counter() - self.started)
+
+
+class TimedQueries(object):
+    """
+    database execute wrapper adding every statement to the ``db`` timing
+    """
+
+    def __init__(self, timings):
+        self.timings = timings
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.timings.add("db", time.perf_counter() - started)
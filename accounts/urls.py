@@ -11,12 +11,31 @@ urlpatterns = [
     path("v1/login/", views.LoginAPIView.as_view(), name="login_api"),
     path("v1/profile/", views.UserProfileAPIView.as_view(), name="user_profile"),
     path("v1/users/", views.CreateListUserApiView.as_view(), name="create_list_user"),
+    path("v1/users/export/", views.ExportUsersApiView.as_view(), name="export_users"),
     path(
         "v1/users/<int:pk>/",
         views.RetrieveUpdateUserApiView.as_view(),
         name="update_user",
     ),
+    path(
+        "v1/users/<int:pk>/remote-status/",
+        views.RemoteUserStatusApiView.as_view(),
+        name="remote_user_status",
+    ),
     path("v1/users-exists/", views.UserExistsApiView.as_view(), name="users_exists"),
+    path("v1/rate-limits/", views.RateLimitStatsApiView.as_view(), name="rate_limits"),
+    path(
+        "v1/response-cache/",
+        views.ResponseCacheStatsApiView.as_view(),
+        name="response_cache",
+    ),
+    path(
+        "v1/audit-events/",
+        views.AuthAuditEventApiView.as_view(),
+        name="audit_events",
+    ),
+    path("v1/audit-stats/", views.AuditStatsApiView.as_view(), name="audit_stats"),
+    path("v1/batch/", views.BatchApiView.as_view(), name="batch"),
     path("v1/permissions/", views.PermissionApiView.as_view(), name="permissions"),
     path("", include(router.urls)),  # group urls
 ]
@@ -0,0 +1,81 @@
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+USER_VERSION_KEY = "accounts:user_version:{}"
+ROLES_VERSION_KEY = "accounts:roles_version"
+DATA_GENERATION_KEY = "accounts:data_generation"
+
+
+def get_counter(key):
+    """
+    return a cache counter, creating it on first use
+    """
+    value = cache.get(key)
+    if value is None:
+        # start from the clock so an evicted counter never reuses old values
+        cache.add(key, int(time.time() * 1000), None)
+        value = cache.get(key)
+    return value
+
+
+def bump_counter(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        return get_counter(key)
+
+
+def on_commit(func, *args):
+    """
+    run ``func(*args)`` once the current transaction commits, right away
+    outside of one
+
+    A reader running between a write and its commit would otherwise cache the
+    old rows under the new version.
+    """
+    if getattr(settings, "VERSION_BUMP_ON_COMMIT", True):
+        transaction.on_commit(partial(func, *args))
+    else:
+        func(*args)
+
+
+def user_version(pk):
+    """
+    version of the user row and role memberships
+    """
+    return get_counter(USER_VERSION_KEY.format(pk))
+
+
+def bump_counters(*keys):
+    for key in keys:
+        bump_counter(key)
+
+
+def bump_user_version(*pks):
+    on_commit(bump_counters, *[USER_VERSION_KEY.format(pk) for pk in pks])
+
+
+def roles_version():
+    """
+    version of every role name and role permission
+    """
+    return get_counter(ROLES_VERSION_KEY)
+
+
+def bump_roles_version():
+    on_commit(bump_counter, ROLES_VERSION_KEY)
+
+
+def data_generation():
+    """
+    generation of all users, roles and memberships, bumped by any write
+    """
+    return get_counter(DATA_GENERATION_KEY)
+
+
+def bump_data_generation():
+    on_commit(bump_counter, DATA_GENERATION_KEY)
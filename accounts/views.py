@@ -1,15 +1,25 @@
-from django.db.models import QuerySet
+import hashlib
+import hmac
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet, prefetch_related_objects
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import status
 from rest_framework.generics import (
     GenericAPIView,
+    ListAPIView,
     ListCreateAPIView,
     RetrieveAPIView,
     UpdateAPIView,
     RetrieveUpdateAPIView,
     get_object_or_404,
 )
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenRefreshView
@@ -17,8 +27,24 @@ from django.contrib.auth.models import Group
 from core.exceptions import AppException
 from core.pagination import GenericListingPagination
 
+from .audit import audit_log, audit_stats, client_ip
 from .auth_state import auth_handler
-from .models import User
+from .batch import run_batch
+from .caching import (
+    response_cache,
+    response_cache_hits,
+    response_cache_key,
+    response_cache_stats,
+)
+from .export import EXPORT_FORMATS
+from .filters import AuthAuditEventFilter, UserFilter
+from .idempotency import idempotent
+from .metrics import registry, render_text
+from .permissions import BitsetPermission
+from .readers import GroupReader, PermissionReader, UserReader
+from .models import AuthAuditEvent, RemoteUserOutbox, User
+from .outbox import enqueue_remote_user
+from .versions import roles_version, user_version
 from .serializers import (
     LoginSerializer,
     RefreshTokenSerializer,
@@ -29,10 +55,123 @@ from .serializers import (
     RetrieveUpdateSerializer,
     PermissionSerializer,
     GroupsCreateUpdateSerializer,
+    AuthAuditEventSerializer,
+    BatchSerializer,
+    BulkRoleAssignmentSerializer,
+    RemoteUserStatusSerializer,
+    query_param_set,
+)
+from .throttling import (
+    LoginIPThrottle,
+    LoginUsernameThrottle,
+    RefreshIPThrottle,
+    UserExistsIPThrottle,
+    throttle_hits,
 )
 from django.contrib.auth.models import Permission
 
 
+def audit_request(request, event, username="", **detail):
+    """
+    record an audit event done by the user of ``request``
+    """
+    audit_log.record(
+        event, username, actor=request.user, ip_address=client_ip(request), **detail
+    )
+
+
+class IdempotencyMixin(object):
+    """
+    replay the stored response of writes retried with an ``Idempotency-Key``
+    """
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super(IdempotencyMixin, self).create(request, *args, **kwargs)
+
+    @idempotent
+    def update(self, request, *args, **kwargs):
+        return super(IdempotencyMixin, self).update(request, *args, **kwargs)
+
+    @idempotent
+    def destroy(self, request, *args, **kwargs):
+        return super(IdempotencyMixin, self).destroy(request, *args, **kwargs)
+
+
+class SparseFieldsQuerysetMixin(object):
+    """
+    prefetch only the relations requested with ``?fields=`` and ``?expand=``
+    """
+
+    def get_prefetch_lookups(self):
+        serializer_class = self.get_serializer_class()
+        if not hasattr(serializer_class, "get_prefetch_lookups"):
+            return []
+        context = self.get_serializer_context()
+        return serializer_class.get_prefetch_lookups(
+            fields=query_param_set(context, "fields"),
+            expand=query_param_set(context, "expand"),
+        )
+
+    def get_queryset(self):
+        queryset = super(SparseFieldsQuerysetMixin, self).get_queryset()
+        return queryset.prefetch_related(*self.get_prefetch_lookups())
+
+
+class FastListMixin(object):
+    """
+    serve list GETs from ``values_list`` rows through ``fast_reader_class``
+
+    Output is the same as the list serializer, without building model
+    instances and serializer fields per row.
+    """
+
+    fast_reader_class = None
+
+    def list(self, request, *args, **kwargs):
+        if self.fast_reader_class is None:
+            return super(FastListMixin, self).list(request, *args, **kwargs)
+        context = self.get_serializer_context()
+        reader = self.fast_reader_class(
+            fields=query_param_set(context, "fields"),
+            expand=query_param_set(context, "expand"),
+        )
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        rows = queryset.values_list(*reader.lookups)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(reader.read(list(page)))
+        return Response(reader.read(list(rows)))
+
+
+class CachedListMixin(object):
+    """
+    cache list responses per query string under the accounts data generation
+
+    Any write to users, roles or memberships bumps the generation, which
+    invalidates every cached page without scanning keys.
+    """
+
+    response_cache_name = None
+
+    def list(self, request, *args, **kwargs):
+        name = self.response_cache_name
+        if name is None:
+            return super(CachedListMixin, self).list(request, *args, **kwargs)
+        cache = response_cache()
+        key = response_cache_key(name, request)
+        data = cache.get(key)
+        if data is not None:
+            response_cache_hits[(name, "hit")] += 1
+            return Response(data)
+        response_cache_hits[(name, "miss")] += 1
+        response = super(CachedListMixin, self).list(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            timeout = getattr(settings, "RESPONSE_CACHE_TIMEOUT", 300)
+            cache.set(key, response.data, timeout)
+        return response
+
+
 class RefreshAPIView(TokenRefreshView):
     """Refresh API
 
@@ -41,6 +180,7 @@ class RefreshAPIView(TokenRefreshView):
     """
 
     permission_classes = [AllowAny]
+    throttle_classes = [RefreshIPThrottle]
     serializer_class = RefreshTokenSerializer
 
 
@@ -53,6 +193,7 @@ class LoginAPIView(GenericAPIView):
     """
 
     permission_classes = [AllowAny]
+    throttle_classes = [LoginIPThrottle, LoginUsernameThrottle]
     serializer_class = LoginSerializer
 
     def post(self, request, *args, **kwargs):
@@ -64,7 +205,7 @@ class LoginAPIView(GenericAPIView):
         return Response(serializer.validated_data, status=status.HTTP_200_OK)
 
 
-class UserProfileAPIView(RetrieveUpdateAPIView):
+class UserProfileAPIView(SparseFieldsQuerysetMixin, RetrieveUpdateAPIView):
     """User Profile API
 
     Return the detailed information of the authenticated user.
@@ -72,22 +213,62 @@ class UserProfileAPIView(RetrieveUpdateAPIView):
 
     """
 
+    compress_response = True
     permission_classes = [IsAuthenticated]
     serializer_class = UserDetailSerializer
     queryset = User.objects.all()
 
     def get_object(self):
-        return self.request.user
-
+        user = self.request.user
+        prefetch_related_objects([user], *self.get_prefetch_lookups())
+        return user
 
-class CreateListUserApiView(ListCreateAPIView, RetrieveUpdateAPIView):
+    def get_etag(self, request):
+        """
+        changes with the user, its role memberships, any role and the query
+        """
+        query = hashlib.md5(request.GET.urlencode().encode()).hexdigest()[:8]
+        user = request.user
+        # the row stamp comes from the database, the versions of memberships
+        # and roles need the shared cache, see the accounts.E001 check
+        stamp = int(user.last_updated.timestamp() * 1000000)
+        # versions start from the clock, so two users can share one
+        versions = f"{user_version(user.pk)}.{roles_version()}"
+        return quote_etag(f"{user.pk}.{stamp}.{versions}.{query}")
+
+    def retrieve(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH", "")
+        # weak comparison, compressed responses carry the weak form
+        etags = [tag.replace("W/", "", 1) for tag in parse_etags(if_none_match)]
+        if if_none_match.strip() == "*" or etag in etags:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        response = super(UserProfileAPIView, self).retrieve(request, *args, **kwargs)
+        response["ETag"] = etag
+        return response
+
+
+class CreateListUserApiView(
+    IdempotencyMixin,
+    CachedListMixin,
+    FastListMixin,
+    SparseFieldsQuerysetMixin,
+    ListCreateAPIView,
+    RetrieveUpdateAPIView,
+):
     """
     create user object return request data.
     """
 
+    compress_response = True
     permission_classes = [AllowAny]
     queryset = User.objects.all()
     pagination_class = GenericListingPagination
+    fast_reader_class = UserReader
+    response_cache_name = "users"
+    # constant in the page size, with or without expand
+    query_budget = {"GET": 12}
+    filterset_class = UserFilter
     lookup_field = "pk"
 
     def get_serializer_class(self):
@@ -99,11 +280,16 @@ class CreateListUserApiView(ListCreateAPIView, RetrieveUpdateAPIView):
         return UsersListSerializer
 
     def perform_create(self, serializer):
-        # create user in the auth server
-        auth_handler.create_remote_user(
-            request=self.request, data=serializer.validated_data
-        )
-        return serializer.save()
+        # the auth server user is created by drain_remote_outbox
+        with transaction.atomic():
+            user = serializer.save()
+            enqueue_remote_user(
+                user,
+                serializer.validated_data,
+                auth_handler.access_token(self.request),
+            )
+        audit_request(self.request, AuthAuditEvent.USER_CREATED, user.username)
+        return user
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -116,7 +302,31 @@ class CreateListUserApiView(ListCreateAPIView, RetrieveUpdateAPIView):
         )
 
 
-class RetrieveUpdateUserApiView(RetrieveUpdateAPIView):
+class ExportUsersApiView(APIView):
+    """
+    stream every user with role names as ndjson or csv.
+
+    ``?export_format=ndjson|csv``, ``format`` is reserved by DRF negotiation.
+    """
+
+    compress_response = True
+    permission_classes = [IsAuthenticated, BitsetPermission]
+    required_permissions = ["accounts.view_user"]
+    chunk_size = 2000
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.query_params.get("export_format", "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            raise AppException("Unsupported export format")
+        stream, content_type, filename = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(
+            stream(User.objects.all(), self.chunk_size), content_type=content_type
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
+class RetrieveUpdateUserApiView(SparseFieldsQuerysetMixin, RetrieveUpdateAPIView):
     """
     create user object return request data.
     """
@@ -139,6 +349,41 @@ class RetrieveUpdateUserApiView(RetrieveUpdateAPIView):
         context.update({"request": self.request})
         return context
 
+    def perform_update(self, serializer):
+        if "groups" not in serializer.validated_data:
+            return super(RetrieveUpdateUserApiView, self).perform_update(serializer)
+        user = serializer.instance
+        before = set(user.groups.values_list("pk", flat=True))
+        super(RetrieveUpdateUserApiView, self).perform_update(serializer)
+        after = set(user.groups.values_list("pk", flat=True))
+        if before != after:
+            audit_request(
+                self.request,
+                AuthAuditEvent.ROLES_ASSIGNED,
+                user.username,
+                added=sorted(after - before),
+                removed=sorted(before - after),
+            )
+
+
+class RemoteUserStatusApiView(RetrieveAPIView):
+    """
+    return the auth server creation status of a user, admins see every user,
+    others only themself.
+    """
+
+    serializer_class = RemoteUserStatusSerializer
+    queryset = RemoteUserOutbox.objects.all()
+    lookup_field = "user_id"
+    lookup_url_kwarg = "pk"
+
+    def get_queryset(self):
+        queryset = super(RemoteUserStatusApiView, self).get_queryset()
+        user = self.request.user
+        if user.is_staff or user.is_superuser:
+            return queryset
+        return queryset.filter(user=user)
+
 
 class UserExistsApiView(APIView):
     """
@@ -146,6 +391,7 @@ class UserExistsApiView(APIView):
     """
 
     permission_classes = [AllowAny]
+    throttle_classes = [UserExistsIPThrottle]
 
     def post(self, request, *args, **kwargs):
         username = request.data.get("username")
@@ -161,29 +407,191 @@ class UserExistsApiView(APIView):
             )  # Otherwise, return True
 
 
-class GroupsAPiView(ModelViewSet):
+class BatchApiView(APIView):
+    """
+    run many accounts api requests in one round-trip
+
+    The batch request is authenticated once and its user is reused by every
+    item. Consecutive reads are dispatched concurrently, writes run in order.
+    An item raising an error answers 500 without failing the others.
+
+    Items call the views directly and skip the middleware, the query budget
+    and the metrics apply to the batch as a whole and the audit events of
+    the items carry the client IP of the batch request.
+    """
+
+    permission_classes = [IsAuthenticated]
+    batch_excluded = True
+
+    def post(self, request, *args, **kwargs):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = run_batch(request, serializer.validated_data["requests"])
+        return Response({"responses": results}, status=status.HTTP_200_OK)
+
+
+class RateLimitStatsApiView(APIView):
+    """
+    allowed and rejected request counts of the rate limits in this process.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        stats = {}
+        for (scope, outcome), count in throttle_hits.items():
+            stats.setdefault(scope, {"allowed": 0, "rejected": 0})[outcome] = count
+        return Response(stats)
+
+
+class ResponseCacheStatsApiView(APIView):
+    """
+    hits, misses and hit ratio of the list response cache in this process.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(response_cache_stats())
+
+
+class AuditEventPagination(CursorPagination):
+    """
+    keyset pages over the time index, constant cost at any depth
+    """
+
+    ordering = ("-occurred_at", "-id")
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+
+class AuthAuditEventApiView(ListAPIView):
+    """
+    list auth audit events, newest first
+    """
+
+    permission_classes = [IsAdminUser]
+    serializer_class = AuthAuditEventSerializer
+    queryset = AuthAuditEvent.objects.all()
+    pagination_class = AuditEventPagination
+    filterset_class = AuthAuditEventFilter
+
+
+class AuditStatsApiView(APIView):
+    """
+    recorded, dropped and flushed audit event counts in this process.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(dict(audit_stats, buffered=len(audit_log.events)))
+
+
+class GroupsAPiView(
+    IdempotencyMixin,
+    CachedListMixin,
+    FastListMixin,
+    SparseFieldsQuerysetMixin,
+    ModelViewSet,
+):
     """
     handle CRUD api for  User group/role
     """
 
+    compress_response = True
     serializer_class = GroupsGetDetailSerializer
     queryset = Group.objects.all()
     pagination_class = GenericListingPagination
+    fast_reader_class = GroupReader
+    response_cache_name = "roles"
+    query_budget = {"list": 12, "retrieve": 10}
 
     def get_serializer_class(self):
         """
         switching serializer class. request method
         """
+        if self.action == "bulk_assign":
+            return BulkRoleAssignmentSerializer
         if self.request.method in ["POST", "PUT", "PATCH"]:
             return GroupsCreateUpdateSerializer
         return GroupsGetDetailSerializer
 
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="bulk-assign",
+        permission_classes=[IsAuthenticated, BitsetPermission],
+        required_permissions=["auth.change_group"],
+    )
+    @idempotent
+    def bulk_assign(self, request, *args, **kwargs):
+        """
+        add or remove users and permissions on roles, return counts
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        counts = serializer.save()
+        audit_request(
+            request,
+            AuthAuditEvent.ROLES_ASSIGNED,
+            roles=serializer.validated_data["roles"],
+            **counts,
+        )
+        return Response(counts, status=status.HTTP_200_OK)
+
+    def perform_create(self, serializer):
+        super(GroupsAPiView, self).perform_create(serializer)
+        audit_request(
+            self.request, AuthAuditEvent.ROLE_CREATED, role=serializer.instance.pk
+        )
+
+    def perform_update(self, serializer):
+        super(GroupsAPiView, self).perform_update(serializer)
+        audit_request(
+            self.request, AuthAuditEvent.ROLE_UPDATED, role=serializer.instance.pk
+        )
+
+    def perform_destroy(self, instance):
+        pk = instance.pk
+        super(GroupsAPiView, self).perform_destroy(instance)
+        audit_request(self.request, AuthAuditEvent.ROLE_DELETED, role=pk)
 
-class PermissionApiView(ListCreateAPIView):
+
+class PermissionApiView(FastListMixin, SparseFieldsQuerysetMixin, ListCreateAPIView):
     """
     list django model permissions
     """
 
+    compress_response = True
     serializer_class = PermissionSerializer
     queryset = Permission.objects.all()
     pagination_class = GenericListingPagination
+    fast_reader_class = PermissionReader
+    query_budget = {"GET": 8}
+
+
+def metrics_allowed(request):
+    if getattr(settings, "METRICS_PUBLIC", False):
+        return True
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if token:
+        header = request.META.get("HTTP_AUTHORIZATION", "")
+        if hmac.compare_digest(header.encode(), f"Bearer {token}".encode()):
+            return True
+    user = getattr(request, "user", None)
+    return bool(user and user.is_staff)
+
+
+def metrics_view(request):
+    """
+    metrics of every worker in the text exposition format, for staff sessions
+    and ``METRICS_TOKEN`` as a bearer token, open with ``METRICS_PUBLIC``
+    """
+    if not metrics_allowed(request):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(
+        render_text(registry.aggregate()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
@@ -4,5 +4,32 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": str(BASE_DIR / "db.sqlite3"),  # noqa
-    }
+    },
+    # stand-in replica, enable it with DATABASE_REPLICAS = ["replica"]
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": str(BASE_DIR / "db.sqlite3"),  # noqa
+        "TEST": {"MIRROR": "default"},
+    },
 }
+DATABASE_REPLICAS = []
+
+# the test cases log in on every setUp, rate limits are tested explicitly
+REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"] = {  # noqa
+    scope: None for scope in REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"]  # noqa
+}
+
+# worker threads do not see the uncommitted data of the test transaction
+BATCH_MAX_WORKERS = 1
+
+# audit events are flushed explicitly by the tests
+AUDIT_FLUSH_THREAD = False
+
+# views over their query budget fail the test instead of logging a warning
+QUERY_BUDGET_RAISE = True
+
+# the test transaction never commits, invalidate caches as the writes happen
+VERSION_BUMP_ON_COMMIT = False
+
+# the test process is the only worker, its LocMemCache is shared by all
+SILENCED_SYSTEM_CHECKS = ["accounts.E001"]
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 
 import datetime
 import os
+from importlib.util import find_spec
 from pathlib import Path
 
 from corsheaders.defaults import default_headers, default_methods  # type: ignore
@@ -48,16 +49,27 @@ INSTALLED_APPS = [
     # Third party apps
     "corsheaders",
     "rest_framework",
-    "drf_yasg",
 ]
 
+# the swagger UI is optional, api/swagger.json is served from OPENAPI_SCHEMA_DIR
+SWAGGER_UI = bool(int(os.environ.get("SWAGGER_UI", DEBUG))) and bool(
+    find_spec("drf_yasg")
+)
+if SWAGGER_UI:
+    INSTALLED_APPS.append("drf_yasg")
+
 MIDDLEWARE = [
+    "accounts.middleware.ServerTimingMiddleware",
+    "accounts.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "accounts.middleware.CompressionMiddleware",
+    "accounts.middleware.QueryBudgetMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "accounts.middleware.ReplicaRoutingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -97,6 +109,98 @@ DATABASES = {
     }
 }
 
+# Read replicas, space separated hosts sharing the primary credentials.
+# Reads of the accounts views go to a replica unless the client wrote within
+# REPLICA_STICKY_SECONDS.
+
+DATABASE_REPLICAS = []
+for index, host in enumerate(os.environ.get("SQL_REPLICA_HOSTS", "").split()):
+    alias = f"replica_{index}"
+    DATABASES[alias] = dict(DATABASES["default"], HOST=host)
+    DATABASES[alias]["TEST"] = {"MIRROR": "default"}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["accounts.routers.ReplicaRouter"]
+REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", 5))
+
+# /api/v1/batch/ limits, reads of a batch share BATCH_MAX_WORKERS threads
+BATCH_MAX_REQUESTS = int(os.environ.get("BATCH_MAX_REQUESTS", 20))
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", 4))
+
+# auth audit events are buffered in process and written in batches
+AUDIT_BUFFER_CAPACITY = int(os.environ.get("AUDIT_BUFFER_CAPACITY", 10000))
+AUDIT_FLUSH_SIZE = int(os.environ.get("AUDIT_FLUSH_SIZE", 500))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", 2.0))
+
+# admin changelists estimate their counts above this many rows
+ADMIN_EXACT_COUNT_THRESHOLD = int(os.environ.get("ADMIN_EXACT_COUNT_THRESHOLD", 10000))
+
+# brotli (when installed) or gzip for text and JSON responses
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", 5))
+COMPRESSION_CACHE_ALIAS = "responses"
+COMPRESSION_CACHE_TIMEOUT = int(os.environ.get("COMPRESSION_CACHE_TIMEOUT", 300))
+
+# responses of writes sent with an Idempotency-Key are replayed for this long
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", 24 * 60 * 60))
+IDEMPOTENCY_WAIT = int(os.environ.get("IDEMPOTENCY_WAIT", 10))
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.environ.get("IDEMPOTENCY_LOCK_TIMEOUT", 60))
+
+# Server-Timing header and a timing log line per request
+SERVER_TIMING = bool(int(os.environ.get("SERVER_TIMING", 0)))
+
+# workers write their metrics to METRICS_DIR, /metrics sums every worker
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+METRICS_INTERVAL = float(os.environ.get("METRICS_INTERVAL", 5))
+# /metrics needs a staff session or METRICS_TOKEN unless METRICS_PUBLIC
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+METRICS_PUBLIC = bool(int(os.environ.get("METRICS_PUBLIC", 0)))
+
+# written by `manage.py build_openapi_schema`
+OPENAPI_SCHEMA_DIR = os.environ.get("OPENAPI_SCHEMA_DIR", os.path.join(BASE_DIR, "openapi"))
+OPENAPI_SCHEMA_MAX_AGE = int(os.environ.get("OPENAPI_SCHEMA_MAX_AGE", 300))
+# swagger-ui loads the prebuilt schema instead of the page url
+SWAGGER_SETTINGS = {"SPEC_URL": ("schema-json", {"format": ".json"})}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "accounts.timing": {
+            "handlers": ["console"],
+            "level": os.environ.get("TIMING_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
+
+# Cache
+# Permission bitsets, user versions and the data generation live in the
+# default cache, it has to be shared between workers. LocMemCache is only
+# accepted with DEBUG, see the accounts.E001 check.
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.environ.get("CACHE_LOCATION", ""),
+    },
+    # list responses, bounded per process and keyed by the shared accounts
+    # data generation of the default cache
+    "responses": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "responses",
+        "TIMEOUT": int(os.environ.get("RESPONSE_CACHE_TIMEOUT", 300)),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 1000))
+        },
+    },
+}
+RESPONSE_CACHE_ALIAS = "responses"
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get("RESPONSE_CACHE_TIMEOUT", 300))
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -146,7 +250,12 @@ REST_FRAMEWORK = {
         "rest_framework.authentication.BasicAuthentication",
     ),
     # "EXCEPTION_HANDLER": "core.exception.custom_exception_handler",
-    "DEFAULT_RENDERER_CLASSES": ("rest_framework.renderers.JSONRenderer",),
+    "DEFAULT_RENDERER_CLASSES": ("accounts.renderers.FastJSONRenderer",),
+    "DEFAULT_PARSER_CLASSES": (
+        "accounts.parsers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
     "DEFAULT_SCHEMA_CLASS": "rest_framework.schemas.coreapi.AutoSchema",
     "TEST_REQUEST_RENDERER_CLASSES": [
         "rest_framework.renderers.MultiPartRenderer",
@@ -155,6 +264,15 @@ REST_FRAMEWORK = {
     ],
     "TEST_REQUEST_DEFAULT_FORMAT": "json",
     "DEFAULT_FILTER_BACKENDS": ["django_filters.rest_framework.DjangoFilterBackend"],
+    # trusted proxies in front of the app, X-Forwarded-For is ignored with 0
+    "NUM_PROXIES": int(os.environ.get("NUM_PROXIES", 0)),
+    # sliding window limits of the proxies to the auth server
+    "DEFAULT_THROTTLE_RATES": {
+        "login_ip": os.environ.get("THROTTLE_LOGIN_IP", "30/min"),
+        "login_username": os.environ.get("THROTTLE_LOGIN_USERNAME", "10/min"),
+        "refresh_ip": os.environ.get("THROTTLE_REFRESH_IP", "60/min"),
+        "users_exists_ip": os.environ.get("THROTTLE_USERS_EXISTS_IP", "60/min"),
+    },
 }
 
 OAUTH2_CLIENT_SECRET_KEY = "django-insecure-6o_oc(^n!ny+6jw+wxhdd%l311&36hu8p4k5=5@c3zg$px$4nd"  # secret key from auth server
@@ -162,6 +280,15 @@ OAUTH2_DEFAULT_SCOPE = "identity:users,identity:roles"
 OAUTH2_GRANT_TYPE = "password"
 JWT_AUTH_BACKEND_CLS = "accounts.backends.AdmarenAuthBackend"
 JWT_AUTH_HANDLER_CLS = "accounts.handler.AdmarenAuthHadler"
+# auth server account creating outbox users, tokens of the users expire
+# before the last retries
+AUTH_SERVICE_USERNAME = os.environ.get("AUTH_SERVICE_USERNAME", "")
+AUTH_SERVICE_PASSWORD = os.environ.get("AUTH_SERVICE_PASSWORD", "")
+# Fernet keys encrypting the passwords of pending outbox rows, comma separated
+# and newest first, derived from SECRET_KEY when empty
+OUTBOX_ENCRYPTION_KEYS = [
+    key for key in os.environ.get("OUTBOX_ENCRYPTION_KEYS", "").split(",") if key
+]
 
 ACCESS_TOKEN_LIFETIME = os.environ.get("ACCESS_TOKEN_LIFETIME", 1)
 REFRESH_TOKEN_LIFETIME = os.environ.get("REFRESH_TOKEN_LIFETIME", 2)
@@ -188,8 +315,8 @@ SIMPLE_JWT = {
 
 CORS_ORIGIN_ALLOW_ALL = bool(os.environ.get("CORS_ORIGIN_ALLOW_ALL", default=1))
 CORS_ALLOW_METHODS = list(default_methods)
-CORS_ALLOW_HEADERS = list(default_headers)
-CORS_EXPOSE_HEADERS = ["status_code"]
+CORS_ALLOW_HEADERS = list(default_headers) + ["idempotency-key"]
+CORS_EXPOSE_HEADERS = ["status_code", "Idempotent-Replayed"]
 CORS_ALLOW_CREDENTIALS = True
 
 # security
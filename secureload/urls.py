@@ -1,37 +1,28 @@
 from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path, re_path
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
-from rest_framework import permissions
 from django.conf.urls.static import static
 
+from accounts.openapi import openapi_schema_view, swagger_ui_view
+from accounts.views import metrics_view
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Secure Load API",
-        default_version="v1",
-        description="Loading Computer",
-        terms_of_service="https://www.google.com/policies/terms/",
-        contact=openapi.Contact(email="info@admaren.com"),
-        license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+
+# drf_yasg is only imported by the swagger UI, on its first request
+swagger_urls = []
+if settings.SWAGGER_UI:
+    swagger_urls.append(
+        re_path(r"^api/swagger/$", swagger_ui_view, name="schema-swagger-ui")
+    )
 
 urlpatterns = [
     re_path(
         r"^api/swagger(?P<format>\.json|\.yaml)$",
-        schema_view.without_ui(cache_timeout=0),
+        openapi_schema_view,
         name="schema-json",
     ),
-    re_path(
-        r"^api/swagger/$",
-        schema_view.with_ui("swagger", cache_timeout=0),
-        name="schema-swagger-ui",
-    ),
+    *swagger_urls,
     path("api/admin/", admin.site.urls),
+    path("metrics", metrics_view, name="metrics"),
     path(
         "api/", include("accounts.urls", namespace="accounts")
     ),  # user management urls